@@ -1,4 +1,6 @@
 from nmigen                  import *
+from nmigen.hdl.rec          import Record
+from nmigen.lib.fifo         import SyncFIFOBuffered
 from .dbgIF                  import DBGIF
 
 # Principle of operation
@@ -17,13 +19,76 @@ from .dbgIF                  import DBGIF
 # =================================
 
 DAP_CONNECT_DEFAULT      = 1                # Default connect is SWD
-DAP_VERSION_STRING       = Cat(C(0x31,8),C(0x2e,8),C(0x30,8),C(0x30,8),C(0,8))
+DAP_VERSION_STRING       = b'1.00\x00'
 DAP_CAPABILITIES         = 0x03             # JTAG and SWD Debug
 DAP_TD_TIMER_FREQ        = 0x3B9ACA00       # 1uS resolution timer
 DAP_MAX_PACKET_COUNT     = 1                # 1 max packet count
 DAP_V1_MAX_PACKET_SIZE   = 64
-DAP_V2_MAX_PACKET_SIZE   = 511
+DAP_V2_MAX_PACKET_SIZE   = 1024             # Two full USB HS bulk packets
 MAX_MSG_LEN              = DAP_V2_MAX_PACKET_SIZE
+USB_MAX_PACKET_SIZE      = 512              # Bulk endpoint size, a short response ending on this boundary is padded
+TX_FIFO_DEPTH            = 4                # Octets buffered between the responses and streamIn
+JTAG_MAX_DEVICES         = 5                # IR lengths the dbgif can hold for the JTAG chain
+
+# DAP_Info responses
+# ==================
+# Each response is held complete, command octet and all, in its own 16 octet slot of the info
+# rom. Its length is known here, so the hardware never has to work it out.
+
+DAP_VERSION_RECORD       = bytes([len(DAP_VERSION_STRING)])+DAP_VERSION_STRING
+
+INFO_SLOT_EMPTY          = 0
+INFO_SLOT_VERSION        = 1
+INFO_SLOT_CAPABILITIES   = 2
+INFO_SLOT_TD_TIMER       = 3
+INFO_SLOT_SWO_SIZE       = 4
+INFO_SLOT_PACKET_COUNT   = 5
+INFO_SLOT_V1_PACKET_SIZE = 6
+INFO_SLOT_V2_PACKET_SIZE = 7
+
+INFO_RECORDS             = {
+    INFO_SLOT_EMPTY          : b'\x00',
+    INFO_SLOT_VERSION        : DAP_VERSION_RECORD,
+    INFO_SLOT_CAPABILITIES   : bytes([1,DAP_CAPABILITIES]),
+    INFO_SLOT_TD_TIMER       : bytes([4])+DAP_TD_TIMER_FREQ.to_bytes(4,'little'),
+    INFO_SLOT_SWO_SIZE       : bytes([4])+bytes(4),
+    INFO_SLOT_PACKET_COUNT   : bytes([1,DAP_MAX_PACKET_COUNT]),
+    INFO_SLOT_V1_PACKET_SIZE : bytes([2])+DAP_V1_MAX_PACKET_SIZE.to_bytes(2,'little'),
+    INFO_SLOT_V2_PACKET_SIZE : bytes([2])+DAP_V2_MAX_PACKET_SIZE.to_bytes(2,'little')
+}
+
+INFO_LEN                 = { slot : 1+len(record) for slot, record in INFO_RECORDS.items() }
+
+INFO_ROM                 = bytearray(256)
+for slot, record in INFO_RECORDS.items():
+    INFO_ROM[slot*16:slot*16+INFO_LEN[slot]]=bytes([0x00])+record
+
+# Each DAP_Info request id is looked up in a dispatch rom, rather than being decoded, to find
+# which slot answers it. An entry holds the response length (bits 0..4), the slot (bits 5..7),
+# a flag that the id is supported (bit 8) and a flag that the V2 slot is to be used instead
+# when running V2 (bit 9). The V2 slot is the V1 slot with its bottom bit set.
+
+INFO_DISPATCH_IDS        = {
+    0x01 : INFO_SLOT_EMPTY,            # Vendor ID (not implemented)
+    0x02 : INFO_SLOT_EMPTY,            # Product ID (not implemented)
+    0x03 : INFO_SLOT_EMPTY,            # Serial Number (not implemented)
+    0x04 : INFO_SLOT_VERSION,          # CMSIS-DAP Firmware Version (string)
+    0x05 : INFO_SLOT_EMPTY,            # Target Device Vendor (not implemented)
+    0x06 : INFO_SLOT_EMPTY,            # Target Device Name (not implemented)
+    0xF0 : INFO_SLOT_CAPABILITIES,     # Capabilities (BYTE) of the Debug Unit
+    0xF1 : INFO_SLOT_TD_TIMER,         # Test Domain Timer parameter information
+    0xFD : INFO_SLOT_SWO_SIZE,         # SWO Trace Buffer Size (WORD)
+    0xFE : INFO_SLOT_PACKET_COUNT,     # Maximum Packet Count (BYTE)
+    0xFF : INFO_SLOT_V1_PACKET_SIZE    # Maximum Packet Size (SHORT), V1 or V2
+}
+
+assert INFO_SLOT_V2_PACKET_SIZE==INFO_SLOT_V1_PACKET_SIZE|1
+assert INFO_LEN[INFO_SLOT_V2_PACKET_SIZE]==INFO_LEN[INFO_SLOT_V1_PACKET_SIZE]
+assert max(INFO_LEN.values())<=16
+
+INFO_DISPATCH            = [0]*256
+for reqid, slot in INFO_DISPATCH_IDS.items():
+    INFO_DISPATCH[reqid] = ((slot==INFO_SLOT_V1_PACKET_SIZE)<<9) | (1<<8) | (slot<<5) | INFO_LEN[slot]
 
 # CMSIS-DAP Protocol Messages
 # ===========================
@@ -59,24 +124,78 @@ DAP_ExecuteCommands      = 0x7f
 DAP_QueueCommands        = 0x7e
 DAP_Invalid              = 0xff
 
-# Commands to the dbgIF
-# =====================
-
-CMD_RESET                = 0
-CMD_PINS_WRITE           = 1
-CMD_TRANSACT             = 2
-CMD_SET_SWD              = 3
-CMD_SET_JTAG             = 4
-CMD_SET_SWJ              = 5
-CMD_SET_JTAG_CFG         = 6
-CMD_SET_CLK              = 7
-CMD_SET_SWD_CFG          = 8
-CMD_WAIT                 = 9
-CMD_CLR_ERR              = 10
-CMD_SET_RST_TMR          = 11
-CMD_SET_TFR_CFG          = 12
-CMD_JTAG_GET_ID          = 13
-CMD_JTAG_RESET           = 14
+# Command dispatch
+# ================
+# Each command is looked up in a dispatch rom to find how many octets (command included) are to
+# be received before it can be actioned, and which handler actions it. An entry holds the handler
+# index (bits 0..4), the receive length (bits 5..7) and a flag that the command is supported
+# (bit 8). Anything not in here is answered with DAP_Invalid.
+
+DAP_COMMANDS             = {
+    # General Commands
+    DAP_Info               : (2, 'RESP_Info'),
+    DAP_HostStatus         : (3, 'RESP_HostStatus'),
+    DAP_Connect            : (2, 'RESP_Connect_Setup'),
+    DAP_Disconnect         : (1, 'RESP_Disconnect'),
+    DAP_WriteABORT         : (6, 'RESP_WriteABORT'),
+    DAP_Delay              : (3, 'RESP_Delay'),
+    DAP_ResetTarget        : (1, 'RESP_ResetTarget'),
+
+    # Transfer Commands
+    DAP_TransferConfigure  : (6, 'RESP_TransferConfigure'),
+    DAP_Transfer           : (3, 'RESP_Transfer_Setup'),
+    DAP_TransferBlock      : (5, 'RESP_TransferBlock_Setup'),
+    DAP_TransferAbort      : (1, 'RESP_Invalid'),
+
+    # Common SWD/JTAG Commands
+    DAP_SWJ_Pins           : (7, 'RESP_SWJ_Pins_Setup'),
+    DAP_SWJ_Clock          : (5, 'RESP_SWJ_Clock'),
+    DAP_SWJ_Sequence       : (2, 'RESP_SWJ_Sequence_Setup'),
+
+    # SWD Commands
+    DAP_SWD_Configure      : (2, 'RESP_SWD_Configure'),
+
+    # SWO Commands
+    DAP_SWO_Transport      : (2, 'RESP_Not_Implemented'),
+    DAP_SWO_Mode           : (2, 'RESP_Not_Implemented'),
+    DAP_SWO_Baudrate       : (5, 'RESP_Not_Implemented'),
+    DAP_SWO_Control        : (2, 'RESP_Not_Implemented'),
+    DAP_SWO_Status         : (1, 'RESP_Not_Implemented'),
+    DAP_SWO_ExtendedStatus : (2, 'RESP_Not_Implemented'),
+    DAP_SWO_Data           : (3, 'RESP_Not_Implemented'),
+
+    # JTAG Commands
+    DAP_JTAG_Sequence      : (2, 'RESP_JTAG_Sequence_Setup'),
+    DAP_JTAG_Configure     : (2, 'RESP_JTAG_Configure_Setup'),
+    DAP_JTAG_IDCODE        : (2, 'RESP_JTAG_IDCODE_Setup')
+}
+
+DAP_HANDLERS             = list(dict.fromkeys(handler for _, handler in DAP_COMMANDS.values()))
+assert len(DAP_HANDLERS)<=32
+
+DAP_DISPATCH             = [0]*256
+for cmd, (rxlen, handler) in DAP_COMMANDS.items():
+    DAP_DISPATCH[cmd]    = (1<<8) | (rxlen<<5) | DAP_HANDLERS.index(handler)
+
+# Commands to the dbgIF (one-hot)
+# ==============================
+
+CMD_RESET                = 1<<0
+CMD_PINS_WRITE           = 1<<1
+CMD_TRANSACT             = 1<<2
+CMD_SET_SWD              = 1<<3
+CMD_SET_JTAG             = 1<<4
+CMD_SET_SWJ              = 1<<5
+CMD_SET_JTAG_CFG         = 1<<6
+CMD_SET_CLK              = 1<<7
+CMD_SET_SWD_CFG          = 1<<8
+CMD_WAIT                 = 1<<9
+CMD_CLR_ERR              = 1<<10
+CMD_SET_RST_TMR          = 1<<11
+CMD_SET_TFR_CFG          = 1<<12
+CMD_JTAG_GET_ID          = 1<<13
+CMD_JTAG_RESET           = 1<<14
+CMD_PINS_SHIFT           = 1<<15
 
 # TODO/Done
 # =========
@@ -114,24 +233,42 @@ CMD_JTAG_RESET           = 14
 # =============================================================================
 
 class WideRam(Elaboratable):
+    # The ram holds 32 bit words. It is filled through a write only port addressed by adr,
+    # and the contents are sent back to the host through a read only port with its own
+    # address, tx_adr.
+    # Writes carry a byte enable per octet of the word, so partial words can be written
+    # without having to read them first.
+    # Reads are always enabled and the data are registered on the way out, so read data
+    # arrive two cycles after tx_adr is presented.
     def __init__(self):
-        self.adr   = Signal(range((MAX_MSG_LEN//4)))
-        self.dat_r = Signal(32)
-        self.dat_w = Signal(32)
-        self.we    = Signal()
-        self.mem   = Memory(width=32, depth=MAX_MSG_LEN//4)
+        self.adr      = Signal(range((MAX_MSG_LEN//4)))
+        self.dat_w    = Signal(32)
+        self.we       = Signal(4)
+        self.tx_adr   = Signal(range((MAX_MSG_LEN//4)))
+        self.tx_dat_r = Signal(32)
+        self.mem      = Memory(width=32, depth=MAX_MSG_LEN//4)
 
     def elaborate(self, platform):
         m = Module()
-        m.submodules.rdport = rdport = self.mem.read_port()
-        m.submodules.wrport = wrport = self.mem.write_port()
+
+        # One write and one read port, so the ram maps onto a simple dual port BRAM. The
+        # read port is not transparent; it is only ever read back once the ram has been
+        # filled, so there is never a write to forward to it and no bypass logic is needed
+        # in front of the BRAM. With a constant read enable the BRAM output register can
+        # be used too.
+        m.submodules.wrport = wrport = self.mem.write_port(granularity=8)
+        m.submodules.txport = txport = self.mem.read_port(transparent=False)
         m.d.comb += [
-            rdport.addr.eq(self.adr),
+            txport.en.eq(1),
             wrport.addr.eq(self.adr),
-            self.dat_r.eq(rdport.data),
             wrport.data.eq(self.dat_w),
             wrport.en.eq(self.we),
+
+            txport.addr.eq(self.tx_adr),
         ]
+
+        m.d.sync += self.tx_dat_r.eq(txport.data)
+
         return m
 
 # This is the CMSIS-DAP handler itself
@@ -147,38 +284,42 @@ class CMSIS_DAP(Elaboratable):
         self.connected    = Signal()       # Flag for if target is connected
 
         self.isV2         = v2Indication
-        self.streamIn     = streamIn
+        self.usbIn        = streamIn       # Stream back to the host, fed through the tx fifo
+        self.streamIn     = Record.like(streamIn) # Responses are written here, one octet per valid
+        self.txFill       = Signal()       # Written with streamIn to zero fill the rest of a V1 packet
+        self.txFilled     = Signal(range(DAP_V1_MAX_PACKET_SIZE)) # Octets of this V1 packet sent to the host
+        self.txSent       = Signal(range(DAP_V2_MAX_PACKET_SIZE)) # Octets of this V2 response sent to the host
+        self.txPadding    = Signal()       # V2 response filled whole USB packets, its pad octet is due
         self.streamOut    = streamOut
         self.rxBlock      = Signal( 7*8 )  # Longest message we pickup is 6 bytes + command
         self.rxLen        = Signal(3)      # Rxlen to pick up
         self.rxedLen      = Signal(3)      # Rxlen picked up so far
+        self.cmdHandler   = Signal(5)      # Index of handler for this command, from the dispatch rom
         self.swjbits      = Signal(8)      # Number of bits of SWJ remaining outstanding
 
-        self.txBlock      = Signal( 14*8 ) # Response to be returned
-        self.txLen        = Signal(range(MAX_MSG_LEN))     # Length of response to be returned
-        self.txedLen      = Signal(range(MAX_MSG_LEN))     # Length of response that has been returned so far
+        self.txMem        = Memory(width=32, depth=4) # Response to be returned, up to 16 octets
+        self.txLen        = Signal(range(MAX_MSG_LEN+1))   # Length of response to be returned
+        self.txedLen      = Signal(range(MAX_MSG_LEN+1))   # Length of response that has been returned so far
         self.busy         = Signal()       # Indicator that we can't receive stream traffic at the moment
+        self.waitLatchPerr= Signal()       # Report dbgif error in the status octet once the command is done
 
         self.txb          = Signal(5)      # State of various orthogonal state machines
 
-        # Support for SWJ_Sequence
-        self.bitcount     = Signal(3)      # Bitcount in transmission sequence
+        # Support for DAP_Info
+        self.infoSlot     = Signal(4)      # Slot in info rom holding the response
 
         # Support for JTAG_Sequence
-        self.tmsValue     = Signal()       # TMS value while performing JTAG sequence
         self.tdoCapture   = Signal()       # Are we capturing TDO when performing JTAG sequence
-        self.tdiData      = Signal(8)      # TDI being sent out
-        self.tdoCount     = Signal(4)      # Count of tdi bits being sent
-        self.tdiCount     = Signal(4)      # Count of tdi bits being received
         self.seqCount     = Signal(8)      # Number of sequences that follow
-        self.tckCycles    = Signal(6)      # Number of tckCycles in this sequence
-        self.tdotgt       = Signal(7)      # Number of tdo cycles to collect (note the extra bit)
+        self.seqState     = Signal(6)      # One-hot state of JTAG sequence processing
+        self.tckCycles    = Signal(6)      # Number of tckCycles left in this sequence (0 is 64)
         self.pendingTx    = Signal(8)      # Next octet to be sent out of streamIn
-        self.tdoBuild     = Signal(8)      # Return value being built
 
         # Support for DAP_Transfer
         self.dapIndex     = Signal(8)      # Index of selected JTAG device
         self.transferCount= Signal(16)     # Number of transfers 1..65535
+        self.txShift      = Signal(32)     # Transfer value being sent back, an octet at a time
+        self.txFinal      = Signal()       # Value in txShift is the last thing in the packet
 
         self.mask         = Signal(32)     # Match mask register
 
@@ -186,7 +327,11 @@ class CMSIS_DAP(Elaboratable):
         self.matchretries = Signal(16)     # Retry counter for Value Matching
 
         self.tfrReq       = Signal(8)      # Transfer request from controller
+        self.tfrRead      = Signal()       # Decoded from tfrReq: read
+        self.tfrMatch     = Signal()       # Decoded from tfrReq: read with value match
+        self.tfrMask      = Signal()       # Decoded from tfrReq: write of match mask
         self.tfrData      = Signal(32)     # Transfer data from controller
+        self.tfrOctets    = Signal(3)      # Octets of next block write collected while this one runs
 
         # CMSIS-DAP Configuration info
         self.ndev         = Signal(8)      # Number of devices in signal chain
@@ -197,53 +342,103 @@ class CMSIS_DAP(Elaboratable):
 
         self.dbgpins      = dbgpins
     # -------------------------------------------------------------------------------------
+    def txWrite(self, m, octet, value, count=1):
+        # Write count octets of value into the response, starting at octet. There is one write
+        # per cycle, so all of the octets must sit in the same word of txMem.
+        if isinstance(octet, int):
+            assert (octet%4)+count<=4
+            m.d.comb += [
+                self.txWr.addr.eq(octet//4),
+                self.txWr.data.eq(Value.cast(value)<<(8*(octet%4))),
+                self.txWr.en.eq(((1<<count)-1)<<(octet%4))
+            ]
+        else:
+            m.d.comb += [
+                self.txWr.addr.eq(octet[2:]),
+                self.txWr.data.eq(Repl(value,4)),
+                self.txWr.en.eq(C(1,4)<<octet[0:2])
+            ]
+
+    def txRead(self, m, octet, count=1):
+        # Read count octets of the response back, starting at octet
+        if isinstance(octet, int):
+            m.d.comb += self.txRd.addr.eq(octet//4)
+            return self.txRd.data.bit_select(8*(octet%4),8*count)
+        m.d.comb += self.txRd.addr.eq(octet[2:])
+        return self.txRd.data.word_select(octet[0:2],8)
+
+    def rxMessage(self, cmd):
+        # Octets are shifted in at the top of rxBlock, so once a command has been received
+        # it occupies the top rxLen octets, command octet first
+        rxLen = DAP_COMMANDS[cmd][0]
+        return self.rxBlock[len(self.rxBlock)-8*rxLen:]
+
+    def dbgIssue(self, m, command, dwrite=None):
+        # Hand a command (and its parameter, if it has one) to the dbgif, then wait for it
+        # to complete and report its status in the response
+        m.d.sync += [
+            self.dbgif.command.eq(command),
+            self.dbgif.go.eq(1)
+            ]
+        if dwrite is not None:
+            m.d.sync += self.dbgif.dwrite.eq(dwrite)
+        m.next = 'DAP_Wait_Done'
+    # -------------------------------------------------------------------------------------
     def RESP_Invalid(self, m):
         # Simply transmit an 'invalid' packet back
-        m.d.sync += [ self.txBlock.word_select(0,8).eq(C(DAP_Invalid,8)), self.txLen.eq(1), self.busy.eq(1) ]
+        self.txWrite(m, 0, C(DAP_Invalid,8))
+        m.d.sync += [ self.txLen.eq(1), self.busy.eq(1) ]
         m.next = 'RESPOND'
     # -------------------------------------------------------------------------------------
     def RESP_Info(self, m):
         # <b:0x00> <b:requestId>
-        # Transmit requested information packet back
-        m.next = 'RESPOND'
+        # Transmit requested information packet back, streamed straight out of its slot in the
+        # info rom once the dispatch rom has said which slot that is
+        rx = self.rxMessage(DAP_Info)
+        m.d.comb += self.infoDispatch.addr.eq(rx.word_select(1,8))
+        entry = self.infoDispatch.data
 
-        with m.Switch(self.rxBlock.word_select(1,8)):
-            # These cases are not implemented in this firmware
-            # Get the Vendor ID, Product ID, Serial Number, Target Device Vendor, Target Device Name
-            with m.Case(0x01, 0x02, 0x03, 0x05, 0x06):
-                m.d.sync += [ self.txLen.eq(2), self.txBlock[8:16].eq(Cat(C(0,8))) ]
-            with m.Case(0x04): # Get the CMSIS-DAP Firmware Version (string)
-                m.d.sync += [ self.txLen.eq(7), self.txBlock[8:56].eq(Cat(C(5,8),DAP_VERSION_STRING))]
-            with m.Case(0xF0): # Get information about the Capabilities (BYTE) of the Debug Unit
-                m.d.sync+=[self.txLen.eq(3), self.txBlock[8:24].eq(Cat(C(1,8),C(DAP_CAPABILITIES,8)))]
-            with m.Case(0xF1): # Get the Test Domain Timer parameter information
-                m.d.sync+=[self.txLen.eq(6), self.txBlock[8:56].eq(Cat(C(8,8),C(DAP_TD_TIMER_FREQ,32)))]
-            with m.Case(0xFD): # Get the SWO Trace Buffer Size (WORD)
-                m.d.sync+=[self.txLen.eq(6), self.txBlock[8:48].eq(Cat(C(4,8),C(0,32)))]
-            with m.Case(0xFE): # Get the maximum Packet Count (BYTE)
-                m.d.sync+=[self.txLen.eq(6), self.txBlock[8:24].eq(Cat(C(1,8),C(DAP_MAX_PACKET_COUNT,8)))]
-            with m.Case(0xFF): # Get the maximum Packet Size (SHORT).
-                with m.If(self.isV2):
-                    m.d.sync+=[self.txLen.eq(6), self.txBlock[8:32].eq(Cat(C(2,8),C(DAP_V2_MAX_PACKET_SIZE,16)))]
-                with m.Else():
-                    m.d.sync+=[self.txLen.eq(6), self.txBlock[8:32].eq(Cat(C(2,8),C(DAP_V1_MAX_PACKET_SIZE,16)))]
-            with m.Default():
-                self.RESP_Invalid(m)
+        with m.If(entry[8]):
+            m.d.sync += [
+                self.infoSlot.eq(entry[5:8] | (entry[9] & self.isV2)),
+                self.txLen.eq(entry[0:5])
+            ]
+            m.next = 'DAP_Info_Stream'
+        with m.Else():
+            self.RESP_Invalid(m)
+
+    def RESP_Info_Stream(self, m):
+        # Send the response straight out of the info rom, without going via the response buffer
+        m.d.comb += self.infoRom.addr.eq(Cat(self.txedLen[0:4],self.infoSlot))
+        with m.If(self.txedLen<self.txLen):
+            with m.If(self.streamIn.ready):
+                m.d.sync += [
+                    self.streamIn.valid.eq(1),
+                    self.streamIn.payload.eq(self.infoRom.data),
+                    self.streamIn.last.eq(self.isV2 & (self.txedLen==self.txLen-1)),
+                    self.txedLen.eq(self.txedLen+1)
+                ]
+        with m.Elif(self.isV2):
+            m.d.sync += self.busy.eq(0)
+            m.next = 'IDLE'
+        with m.Else():
+            m.next = 'V1PACKETFILL'
     # -------------------------------------------------------------------------------------
     def RESP_Not_Implemented(self, m):
-        m.d.sync += self.txBlock.word_select(1,8).eq(C(0xff,8))
+        self.txWrite(m, 1, C(0xff,8))
         m.next = 'RESPOND'
     # -------------------------------------------------------------------------------------
     def RESP_HostStatus(self, m):
         # <b:0x01> <b:type> <b:status>
         # Set LEDs for condition of debugger
+        rx = self.rxMessage(DAP_HostStatus)
         m.next = 'RESPOND'
 
-        with m.Switch(self.rxBlock.word_select(1,8)):
+        with m.Switch(rx.word_select(1,8)):
             with m.Case(0x00): # Connect LED
-                m.d.sync+=self.connected.eq(self.rxBlock.word_select(2,8)==C(1,8))
+                m.d.sync+=self.connected.eq(rx.word_select(2,8)==C(1,8))
             with m.Case(0x01): # Running LED
-                m.d.sync+=self.running.eq(self.rxBlock.word_select(2,8)==C(1,8))
+                m.d.sync+=self.running.eq(rx.word_select(2,8)==C(1,8))
             with m.Default():
                 self.RESP_Invalid(m)
     # -------------------------------------------------------------------------------------
@@ -251,45 +446,37 @@ class CMSIS_DAP(Elaboratable):
     def RESP_Connect_Setup(self, m):
         # <b:0x02> <b:Port>
         # Perform connect operation
+        rx = self.rxMessage(DAP_Connect)
         self.RESP_Invalid(m)
 
         if (DAP_CAPABILITIES&(1<<0)):
             # SWD mode is permitted
-            with m.If ((((self.rxBlock.word_select(1,8))==0) & (DAP_CONNECT_DEFAULT==1)) |
-                       ((self.rxBlock.word_select(1,8))==1)):
+            with m.If ((((rx.word_select(1,8))==0) & (DAP_CONNECT_DEFAULT==1)) |
+                       ((rx.word_select(1,8))==1)):
+                self.txWrite(m, 0, Cat(rx.word_select(0,8),C(1,8)), 2)
                 m.d.sync += [
-                    self.txBlock.word_select(0,16).eq(Cat(self.rxBlock.word_select(0,8),C(1,8))),
-                    self.dbgif.command.eq(CMD_SET_SWD),
                     self.txLen.eq(2),
-                    self.dbgif.go.eq(1)
+                    self.waitLatchPerr.eq(0)
                     ]
-                m.next = 'DAP_Wait_Connect_Done'
+                self.dbgIssue(m, CMD_SET_SWD)
 
         if (DAP_CAPABILITIES&(1<<1)):
-            with m.If ((((self.rxBlock.word_select(1,8))==0) & (DAP_CONNECT_DEFAULT==2)) |
-                       ((self.rxBlock.word_select(1,8))==2)):
+            with m.If ((((rx.word_select(1,8))==0) & (DAP_CONNECT_DEFAULT==2)) |
+                       ((rx.word_select(1,8))==2)):
+                self.txWrite(m, 0, Cat(rx.word_select(0,8),C(2,8)), 2)
                 m.d.sync += [
-                    self.txBlock.word_select(0,16).eq(Cat(self.rxBlock.word_select(0,8),C(2,8))),
-                    self.dbgif.command.eq(CMD_SET_JTAG),
                     self.txLen.eq(2),
-                    self.dbgif.go.eq(1)
+                    self.waitLatchPerr.eq(0)
                     ]
-                m.next = 'DAP_Wait_Connect_Done'
-
-    def RESP_Wait_Connect_Done(self, m):
-        # Generic wait for inferior to process command
-        with m.If((self.dbgif.go==1) & (self.dbg_done==0)):
-            m.d.sync+=self.dbgif.go.eq(0)
-        with m.If((self.dbgif.go==0) & (self.dbg_done==1)):
-            m.next='RESPOND'
+                self.dbgIssue(m, CMD_SET_JTAG)
     # -------------------------------------------------------------------------------------
     # -------------------------------------------------------------------------------------
     def RESP_Wait_Done(self, m):
-        # Generic wait for inferior to process command
-        with m.If((self.dbgif.go==1) & (self.dbg_done==0)):
-            m.d.sync+=self.dbgif.go.eq(0)
+        # Generic wait for inferior to process command, reporting any error in the status
+        # octet unless the command has already put its own response there
         with m.If((self.dbgif.go==0) & (self.dbg_done==1)):
-            m.d.sync += self.txBlock.bit_select(8,8).eq(Mux(self.dbgif.perr,0xff,0))
+            with m.If(self.waitLatchPerr):
+                self.txWrite(m, 1, Mux(self.dbgif.perr,0xff,0))
             m.next='RESPOND'
     # -------------------------------------------------------------------------------------
     def RESP_Disconnect(self, m):
@@ -305,121 +492,88 @@ class CMSIS_DAP(Elaboratable):
         # <b:0x08> <b:DapIndex> <w:AbortCode>
         # Post abort code to register
         # TODO: Add ABORT for JTAG
+        rx = self.rxMessage(DAP_WriteABORT)
         m.d.sync += [
-            self.dbgif.command.eq(CMD_TRANSACT),
             self.dbgif.apndp.eq(0),
             self.dbgif.rnw.eq(0),
-            self.dbgif.addr32.eq(0),
-            self.dbgif.dwrite.eq(self.rxBlock.bit_select(16,32)),
-            self.dbgif.go.eq(1)
+            self.dbgif.addr32.eq(0)
         ]
-
-        m.next = 'DAP_Wait_Done'
+        self.dbgIssue(m, CMD_TRANSACT, rx.bit_select(16,32))
     # -------------------------------------------------------------------------------------
     def RESP_Delay(self, m):
         # <b:0x09> <s:Delay>
         # Delay for programmed number of uS
-        m.d.sync += [
-            self.dbgif.dwrite.eq( Cat(self.rxBlock.bit_select(16,8),self.rxBlock.bit_select(8,8))),
-            self.dbgif.command.eq( CMD_WAIT ),
-            self.dbgif.go.eq(1)
-        ]
-        m.next = 'DAP_Wait_Done'
+        rx = self.rxMessage(DAP_Delay)
+        self.dbgIssue(m, CMD_WAIT, Cat(rx.bit_select(16,8),rx.bit_select(8,8)))
     # -------------------------------------------------------------------------------------
     def RESP_ResetTarget(self, m):
         # <b:0x0A>
         # Reset the target
-        m.d.sync += [
-            self.txBlock.bit_select(8,16).eq(Cat(C(0,8),C(1,1),C(0,7))),
-            self.txLen.eq(3),
-            self.dbgif.command.eq( CMD_RESET ),
-            self.dbgif.go.eq(1)
-        ]
-        m.next = 'DAP_Wait_Done'
+        self.txWrite(m, 1, C(0x0100,16), 2)
+        m.d.sync += self.txLen.eq(3)
+        self.dbgIssue(m, CMD_RESET)
     # -------------------------------------------------------------------------------------
     def RESP_SWJ_Pins_Setup(self, m):
         # <b:0x10> <b:PinOutput> <b:PinSelect> <w:PinWait>
         # Control and monitor SWJ/JTAG pins
+        rx = self.rxMessage(DAP_SWJ_Pins)
         m.d.sync += [
-            self.dbgif.pinsin.eq( self.rxBlock.bit_select(8,16) ),
-            self.dbgif.countdown.eq( self.txBlock.bit_select(24,32) )
+            self.dbgif.pinsin.eq( rx.bit_select(8,16) ),
+            self.dbgif.countdown.eq( rx.bit_select(24,32) )
             ]
         m.next = 'DAP_SWJ_Pins_PROCESS';
 
     def RESP_SWJ_Pins_Process(self, m):
         # Spin waiting for debug interface to do its thing
         with m.If (self.dbg_done):
-            m.d.sync += [
-                self.txBlock.word_select(1,8).eq(self.dbgif.pinsout),
-                self.txLen.eq(2)
-            ]
+            self.txWrite(m, 1, self.dbgif.pinsout)
+            m.d.sync += self.txLen.eq(2)
         m.next = 'RESPOND'
     # -------------------------------------------------------------------------------------
     def RESP_SWJ_Clock(self, m):
         # <0x11> <w:newclock>
         # Set clock frequency for JTAG and SWD comms
-        m.d.sync += [
-            self.dbgif.dwrite.eq( self.rxBlock.bit_select(8,32) ),
-            self.dbgif.command.eq( CMD_SET_CLK ),
-            self.dbgif.go.eq(1)
-            ]
-        m.next = 'DAP_Wait_Done'
+        rx = self.rxMessage(DAP_SWJ_Clock)
+        self.dbgIssue(m, CMD_SET_CLK, rx.bit_select(8,32))
     # -------------------------------------------------------------------------------------
     # -------------------------------------------------------------------------------------
     def RESP_SWJ_Sequence_Setup(self, m):
         # <b:0x12> <b:Count> [n x <bSeqDat>.....]
         # Generate SWJ Sequence data
+        rx = self.rxMessage(DAP_SWJ_Sequence)
         m.d.sync += [
-            # Number of bits to be transferred
-            self.transferCount.eq(Mux(self.rxBlock.bit_select(8,8),Cat(self.rxBlock.bit_select(8,8),C(0,8)),C(256,16))),
+            # Number of bits to be transferred, a count of zero means 256
+            self.transferCount.eq(Cat(rx.bit_select(8,8),rx.bit_select(8,8)==0)),
             self.txb.eq(0),
 
-            # Setup to have control over swdo, swclk and swwr (set for output), with clocks of 1 clock cycle
-            self.dbgif.dwrite.eq(0),
+            # Setup to have control over swdo, swclk and swwr (set for output), with bits shifted
+            # out by the dbgif an octet at a time
             self.dbgif.pinsin.eq(0b0001_0011_0001_0000),
-            self.bitcount.eq(0),
-            self.dbgif.command.eq(CMD_PINS_WRITE)
+            self.dbgif.command.eq(CMD_PINS_SHIFT)
             ]
         m.next = 'DAP_SWJ_Sequence_PROCESS'
 
     def RESP_SWJ_Sequence_Process(self, m):
         with m.Switch(self.txb):
-            with m.Case(0): # Grab next octet(s) from stream ------------------------------------------------------------
+            with m.Case(0): # Grab next octet from stream and shift it out -------------------------------------------
                 with m.If(self.streamOut.valid & self.streamOut.ready):
                     m.d.sync += [
-                        self.tfrData.eq(self.streamOut.payload),
+                        self.dbgif.dwrite.eq(self.streamOut.payload),
+                        self.dbgif.bitcount.eq(Mux(self.transferCount>8,8,self.transferCount)),
+                        self.dbgif.go.eq(1),
                         self.txb.eq(1),
                         self.busy.eq(1)
                     ]
                 with m.Else():
                     m.d.sync += self.busy.eq(0)
 
-            with m.Case(1): # Write the data bit -----------------------------------------------------------------------
-                m.d.sync += [
-                    self.dbgif.pinsin[0:2].eq(Cat(C(0,1),self.tfrData.bit_select(0,1))),
-                    self.tfrData.eq(Cat(C(1,0),self.tfrData[1:8])),
-                    self.transferCount.eq(self.transferCount-1),
-                    self.dbgif.go.eq(1),
-                    self.bitcount.eq(self.bitcount+1),
-                    self.txb.eq(2)
-                ]
-
-            with m.Case(2): # Wait for bit to be accepted, then we can drop clk ----------------------------------------
-                with m.If(self.dbg_done==0):
-                    m.d.sync += self.dbgif.go.eq(0)
+            with m.Case(1): # Wait for octet to be shifted out, then move to next one ----------------------------------
                 with m.If ((self.dbgif.go==0) & (self.dbg_done==1)):
-                    m.d.sync += [
-                        self.dbgif.pinsin[0].eq(1),
-                        self.dbgif.go.eq(1),
-                        self.txb.eq(3)
+                    with m.If(self.transferCount>8):
+                        m.d.sync += [
+                            self.transferCount.eq(self.transferCount-8),
+                            self.txb.eq(0)
                         ]
-
-            with m.Case(3): # Now wait for clock to be complete, and move to next bit ----------------------------------
-                with m.If(self.dbg_done==0):
-                    m.d.sync += self.dbgif.go.eq(0)
-                with m.If ((self.dbgif.go==0) & (self.dbg_done==1)):
-                    with m.If(self.transferCount!=0):
-                        m.d.sync += self.txb.eq(Mux(self.bitcount,1,0))
                     with m.Else():
                         m.next = 'DAP_Wait_Done'
 
@@ -428,98 +582,123 @@ class CMSIS_DAP(Elaboratable):
     def RESP_SWD_Configure(self, m):
         # <0x13> <ConfigByte>
         # Setup configuration for SWD
-        m.d.sync += [
-            self.dbgif.dwrite.eq( self.rxBlock.bit_select(8,8) ),
-            self.dbgif.command.eq( CMD_SET_SWD_CFG ),
-            self.dbgif.go.eq(1)
-            ]
-        m.next = 'DAP_Wait_Done'
+        rx = self.rxMessage(DAP_SWD_Configure)
+        self.dbgIssue(m, CMD_SET_SWD_CFG, rx.bit_select(8,8))
     # -------------------------------------------------------------------------------------
     # -------------------------------------------------------------------------------------
-    def RESP_JTAG_Configure(self, m):
+    def RESP_JTAG_Configure_Setup(self, m):
         # <b:0x15> <b:Count> n x [ <b:IRLength> ]
         # Set IR Length for Chain
+        rx = self.rxMessage(DAP_JTAG_Configure)
+
+        # We cope with up to JTAG_MAX_DEVICES devices with IRLen of 1..32 bits. The IR lengths
+        # are taken from the stream one per cycle and shifted down into dwrite, so only one
+        # subtractor is needed, then the whole lot is handed to the dbgif in a single command.
+        # A longer chain can't be held, so it's refused rather than configured wrongly.
+        with m.If(rx.bit_select(8,8)>JTAG_MAX_DEVICES):
+            self.txWrite(m, 1, C(0xff,8))
+            m.next = 'RESPOND'
+        with m.Else():
+            m.d.sync += [
+                self.dbgif.dwrite.eq( rx.bit_select(8,5) ),
+                self.transferCount.eq( rx.bit_select(8,8) ),
+                self.txb.eq(0)
+                ]
+            m.next = 'DAP_JTAG_Configure_PROCESS'
 
-        m.d.sync += [
-            # We cope with up to 5 devices with IRLen of 1..32 bits
-            self.dbgif.dwrite.eq( Cat( self.rxBlock.bit_select(11,5)-1,
-                                       self.rxBlock.bit_select(19,5)-1,
-                                       self.rxBlock.bit_select(27,5)-1,
-                                       self.rxBlock.bit_select(35,5)-1,
-                                       self.rxBlock.bit_select(43,5)-1,
-                                       self.rxBlock.bit_select(51,5)-1,
-                                       C(2,0) )
-                                 ),
-            self.dbgif.command.eq( CMD_SET_JTAG_CFG ),
-            self.dbgif.go.eq(1)
-            ]
-        m.next = 'DAP_Wait_Done'
+    def RESP_JTAG_Configure_Process(self, m):
+        with m.If(self.txb==JTAG_MAX_DEVICES):
+            # All slots filled, send them down
+            m.d.sync += self.busy.eq(1)
+            self.dbgIssue(m, CMD_SET_JTAG_CFG)
+
+        with m.Elif(self.transferCount!=0):
+            # Take the next IR length from the stream
+            with m.If(self.streamOut.valid & self.streamOut.ready):
+                m.d.sync += [
+                    self.dbgif.dwrite[5:30].eq( Cat( self.dbgif.dwrite[10:30], self.streamOut.payload[0:5]-1 ) ),
+                    self.transferCount.eq(self.transferCount-1),
+                    self.txb.eq(self.txb+1),
+                    self.busy.eq((self.transferCount==1) | (self.txb==JTAG_MAX_DEVICES-1))
+                    ]
+            with m.Else():
+                m.d.sync += self.busy.eq(0)
+
+        with m.Else():
+            # Fewer devices than slots, shift the rest down into place
+            m.d.sync += [
+                self.dbgif.dwrite[5:30].eq( Cat( self.dbgif.dwrite[10:30], C(0,5) ) ),
+                self.txb.eq(self.txb+1),
+                self.busy.eq(1)
+                ]
     # -------------------------------------------------------------------------------------
     # -------------------------------------------------------------------------------------
     def RESP_JTAG_IDCODE_Setup(self, m):
         # <b:0x16> <b:JTAGIndex>
         # Request ID code for specified device
+        rx = self.rxMessage(DAP_JTAG_IDCODE)
         m.d.sync += [
             self.dbgif.command.eq(CMD_JTAG_GET_ID),
-            self.dbgif.dwrite.eq( self.rxBlock.bit_select(8,8) ),
+            self.dbgif.dwrite.eq( rx.bit_select(8,8) ),
             self.txLen.eq(6),
-            self.txBlock.bit_select(16,32).eq(0),
+            self.txb.eq(0),
             self.dbgif.go.eq(1)
             ]
 
         m.next = 'JTAG_IDCODE_Process'
 
     def RESP_JTAG_IDCODE_Process(self, m):
-        with m.If(self.dbg_done==0):
-            m.d.sync += self.dbgif.go.eq(0)
-        with m.Elif(self.dbg_done==1):
-            m.d.sync += self.txBlock.bit_select(16,32).eq(self.dbgif.dread)
-            m.next = "RESPOND"
+        with m.If((self.dbgif.go==0) & (self.dbg_done==1)):
+            # The IDCODE straddles two words of the response, so takes two writes
+            with m.If(self.txb==0):
+                self.txWrite(m, 2, self.dbgif.dread.bit_select(0,16), 2)
+                m.d.sync += self.txb.eq(1)
+            with m.Else():
+                self.txWrite(m, 4, self.dbgif.dread.bit_select(16,16), 2)
+                m.next = "RESPOND"
 
     # -------------------------------------------------------------------------------------
     def RESP_TransferConfigure(self, m):
         # <b:0x04> <b:IdleCycles> <s:WaitRetry> <s:MatchRetry>
         # Configure transfer parameters
+        rx = self.rxMessage(DAP_TransferConfigure)
         m.d.sync += [
-            self.waitRetry.eq(self.rxBlock.bit_select(16,16)),
-            self.matchRetry.eq(self.rxBlock.bit_select(32,16)),
-
-            # Send idleCycles to layers below
-            self.dbgif.dwrite.eq(self.rxBlock.bit_select(8,8)),
-            self.dbgif.command.eq(CMD_SET_TFR_CFG),
-            self.dbgif.go.eq(1)
+            self.waitRetry.eq(rx.bit_select(16,16)),
+            self.matchRetry.eq(rx.bit_select(32,16))
         ]
-        m.next = 'DAP_Wait_Done'
+
+        # Send idleCycles to layers below
+        self.dbgIssue(m, CMD_SET_TFR_CFG, rx.bit_select(8,8))
     # -------------------------------------------------------------------------------------
     # -------------------------------------------------------------------------------------
     def RESP_Transfer_Setup(self, m):
         # <0x05> <b:DapIndex> <b:TfrCount] n x [ <b:TfrReq> <w:TfrData>]
         # Triggered at start of a Transfer data sequence
         # We have the command, index and transfer count, need to set up to get the transfers
+        rx = self.rxMessage(DAP_Transfer)
 
         m.d.sync += [
-            self.dapIndex.eq(self.rxBlock.bit_select(8,8)),
-            self.transferCount.eq(self.rxBlock.bit_select(16,8)),
+            self.dapIndex.eq(rx.bit_select(8,8)),
+            self.transferCount.eq(rx.bit_select(16,8)),
             self.tfrram.adr.eq(0),
             self.busy.eq(1),
+            self.txLen.eq(3),
             self.txb.eq(0)
         ]
 
         # Filter for case someone tries to send us no transfers to perform
         # in which case we send back a good ack!
-        with m.If(self.rxBlock.bit_select(16,8)!=0):
+        with m.If(rx.bit_select(16,8)!=0):
             m.next = 'DAP_Transfer_PROCESS'
         with m.Else():
-            m.d.sync += [
-                self.txBlock.word_select(2,8).eq(C(1,8)),
-                self.busy.eq(0),
-                self.txLen.eq(3)
-                ]
+            self.txWrite(m, 2, C(1,8))
+            m.d.sync += self.busy.eq(0)
             m.next = 'RESPOND'
 
 
     def RESP_Transfer_Process(self, m):
-        m.d.comb += self.tfrram.dat_w.eq(self.dbgif.dread)
+        # Only commit read data to the ram for transfers that will keep it
+        m.d.comb += self.tfrram.we.eq(Repl(self.dbg_latch & (self.dbgif.again | ((~self.dbgif.ignoreData) & self.dbgif.rnw)),4))
 
         # By default we don't want to receive any more stream data
         m.d.sync += self.busy.eq(1)
@@ -531,19 +710,25 @@ class CMSIS_DAP(Elaboratable):
                 with m.Else():
                     m.d.sync += [
                         self.tfrReq.eq(self.streamOut.payload),
+                        self.tfrRead.eq(self.streamOut.payload.bit_select(1,1)),
+                        self.tfrMatch.eq(self.streamOut.payload.bit_select(4,1)),
+                        self.tfrMask.eq(self.streamOut.payload.bit_select(5,1)),
                         self.retries.eq(0)
                     ]
 
                     # This is a good transaction from the stream, so record the fact it's in flow
-                    m.d.sync += self.txBlock.word_select(1,8).eq(self.txBlock.word_select(1,8)+1)
+                    self.txWrite(m, 1, self.txRead(m, 1)+1)
 
                     # So now go do the read or write as appropriate
                     with m.If ((~self.streamOut.payload.bit_select(1,1)) |
                                self.streamOut.payload.bit_select(4,1) |
                                self.streamOut.payload.bit_select(5,1) ):
 
-                        # Need to collect the value
-                        m.d.sync += self.txb.eq(1)
+                        # Need to collect the value, so stay ready for it
+                        m.d.sync += [
+                            self.txb.eq(1),
+                            self.busy.eq(0)
+                        ]
                     with m.Else():
                         # It's a read, no value to collect
                         m.d.sync += [
@@ -553,15 +738,18 @@ class CMSIS_DAP(Elaboratable):
 
             with m.Case(1,2,3,4): # Collect the 32 bit transfer Data to go with the command ----------------------------
                 with m.If(self.streamOut.valid & self.streamOut.ready):
+                    # Octets arrive lsb first, so shift each one in from the top
+                    # Keep taking octets back to back until the last one of the word
                     m.d.sync+=[
-                        self.tfrData.word_select(self.txb-1,8).eq(self.streamOut.payload),
-                        self.txb.eq(self.txb+1)
+                        self.tfrData.eq(Cat(self.tfrData[8:32],self.streamOut.payload)),
+                        self.txb.eq(self.txb+1),
+                        self.busy.eq(self.txb==4)
                     ]
 
-                    with m.If(self.tfrReq.bit_select(5,1) & (self.txb==5)):
+                    with m.If(self.tfrMask & (self.txb==5)):
                         # This is a match register write
                         m.d.sync += [
-                            self.mask.eq(Cat(self.streamOut.payload,self.tfrData.bit_select(0,24))),
+                            self.mask.eq(Cat(self.tfrData[8:32],self.streamOut.payload)),
                             self.txb.eq(0)
                         ]
                 with m.Else():
@@ -571,7 +759,7 @@ class CMSIS_DAP(Elaboratable):
                 m.d.sync += [
                     self.dbgif.command.eq(CMD_TRANSACT),
                     self.dbgif.apndp.eq(self.tfrReq.bit_select(0,1)),
-                    self.dbgif.rnw.eq(self.tfrReq.bit_select(1,1)),
+                    self.dbgif.rnw.eq(self.tfrRead),
                     self.dbgif.addr32.eq(self.tfrReq.bit_select(2,2)),
                     self.dbgif.dwrite.eq(self.tfrData),
                     self.dbgif.go.eq(1),
@@ -580,33 +768,41 @@ class CMSIS_DAP(Elaboratable):
 
             with m.Case(6): # We sent a command, wait for it to start being executed -----------------------------------
                 with m.If(self.dbg_done==0):
-                    m.d.sync+=[
-                        self.dbgif.go.eq(0),
-                        self.txb.eq(7)
-                    ]
+                    m.d.sync += self.txb.eq(7)
 
             with m.Case(7): # Wait for command to complete -------------------------------------------------------------
                 with m.If(self.dbg_done==1):
                     # Write return value from this command into return frame
-                    m.d.sync += self.txBlock.word_select(2,8).eq(Cat(self.dbgif.ack,self.dbgif.perr)),
+                    self.txWrite(m, 2, Cat(self.dbgif.ack,self.dbgif.perr))
 
                     # Now lets figure out how to handle this response....
 
+                    # Anything repeated goes straight back out, the dbgif is already set up for it
+
                     # If we're to retry, then lets do it
                     with m.If(self.dbgif.ack==0b010):
-                        m.d.sync += [
-                            self.retries.eq(self.retries+1),
-                            self.txb.eq(Mux((self.retries<self.waitRetry),5,8))
-                        ]
+                        m.d.sync += self.retries.eq(self.retries+1)
+                        with m.If(self.retries<self.waitRetry):
+                            m.d.sync += [
+                                self.dbgif.go.eq(1),
+                                self.txb.eq(6)
+                            ]
+                        with m.Else():
+                            m.d.sync += self.txb.eq(0)
+                            m.next = 'DAP_Transfer_Header'
 
-                    with m.Elif(self.tfrReq.bit_select(4,1)):
+                    with m.Elif(self.tfrMatch):
                         # This is a transfer match request
                         with m.If(((self.dbgif.dread & self.mask) !=self.tfrData) & (self.matchretries<self.matchRetry)):
                             # Not a match and we've run out of attempts, so set bit 4
-                            m.d.sync += self.txBlock.bit_select(21,1).eq(1)
-                            m.d.sync += self.txb.eq(8)
+                            self.txWrite(m, 2, Cat(self.dbgif.ack,self.dbgif.perr,C(0,1),C(1,1)))
+                            m.d.sync += self.txb.eq(0)
+                            m.next = 'DAP_Transfer_Header'
                         with m.Else():
-                            m.d.sync += self.txb.eq(5)
+                            m.d.sync += [
+                                self.dbgif.go.eq(1),
+                                self.txb.eq(6)
+                            ]
 
                     with m.Else():
                         # Check to see if this is a new post (i.e. data to be ignored), or data
@@ -617,7 +813,10 @@ class CMSIS_DAP(Elaboratable):
                         # It it was a good transfer, then keep going if appropriate
                         with m.If(self.dbgif.again):
                             # Just repeat this send
-                            m.d.sync += self.txb.eq(5)
+                            m.d.sync += [
+                                self.dbgif.go.eq(1),
+                                self.txb.eq(6)
+                            ]
                         with m.Else():
                             # This transaction is something we want to record
                             m.d.sync += self.transferCount.eq(self.transferCount-1)
@@ -629,29 +828,21 @@ class CMSIS_DAP(Elaboratable):
                                     # Debug interface is in posting mode, better do one final read to collect the data
                                     m.d.sync += [
                                         self.tfrReq.eq(0x0E), # Read RDBUFF
+                                        self.tfrRead.eq(1),
+                                        self.tfrMatch.eq(0),
+                                        self.tfrMask.eq(0),
+                                        self.dbgif.apndp.eq(0),
+                                        self.dbgif.rnw.eq(1),
+                                        self.dbgif.addr32.eq(3),
+                                        self.dbgif.go.eq(1),
                                         self.retries.eq(0),
-                                        self.txb.eq(5)
+                                        self.txb.eq(6)
                                     ]
                                 with m.Else():
                                     # Otherwise let's wrap up
                                     # All data have been processed, now lets send them back
-                                    m.d.sync += self.txb.eq(8)
-
-            with m.Case(8,9,10): # Transfer completed, start sending data back -----------------------------------------
-                with m.If(self.streamIn.ready):
-                    m.d.sync += [
-                        self.streamIn.payload.eq(self.txBlock.word_select(self.txb-8,8)),
-                        self.streamIn.valid.eq(1),
-                        self.txb.eq(self.txb+1),
-                        self.streamIn.last.eq(self.isV2 & (self.txb==10) & (self.tfrram.adr==0))
-                    ]
-
-            with m.Case(11): # Initial data sent, send any remaining material ------------------------------------------
-                m.next = 'UPLOAD_RXED_DATA'
-                m.d.sync += [
-                    self.txb.eq(0),
-                    self.txedLen.eq((self.tfrram.adr*4)+3)  # Record length of data to be returned
-                ]
+                                    m.d.sync += self.txb.eq(0)
+                                    m.next = 'DAP_Transfer_Header'
 
     # -------------------------------------------------------------------------------------
     # -------------------------------------------------------------------------------------
@@ -659,57 +850,73 @@ class CMSIS_DAP(Elaboratable):
         # <B:0x06> <B:DapIndex> <S:TransferCount> <B:TransferReq> n x [ <W:TransferData> ])
         # Triggered at start of a TransferBlock data sequence
         # We have the command, index and transfer count, need to set up to get the transfers
-
+        rx = self.rxMessage(DAP_TransferBlock)
         m.d.sync += [
             self.tfrram.adr.eq(0),
             self.dbgif.command.eq(CMD_TRANSACT),
-            self.retries.eq(0),
+            self.txLen.eq(4),
 
             # DAP Index is 1 byte in
-            self.dapIndex.eq(self.rxBlock.bit_select(8,8)),
+            self.dapIndex.eq(rx.bit_select(8,8)),
 
             # Transfer count is 2 bytes in
-            self.transferCount.eq(self.rxBlock.bit_select(16,16)),
+            self.transferCount.eq(rx.bit_select(16,16)),
 
             # Transfer Req is 4 bytes in
-            self.dbgif.apndp.eq(self.rxBlock.bit_select(32,1)),
-            self.dbgif.rnw.eq(self.rxBlock.bit_select(33,1)),
-            self.dbgif.addr32.eq(self.rxBlock.bit_select(34,2)),
+            self.dbgif.apndp.eq(rx.bit_select(32,1)),
+            self.dbgif.rnw.eq(rx.bit_select(33,1)),
+            self.dbgif.addr32.eq(rx.bit_select(34,2)),
 
-            # Set to one the number of responses sent back
-            self.txBlock.bit_select(8,16).eq(C(1,16)),
 
             # Decide which state to jump to depending on if we have data
-            self.txb.eq(Mux(self.rxBlock.bit_select(33,1),4,0)),
+            self.txb.eq(Mux(rx.bit_select(33,1),4,0)),
 
             # ...and start the retries counter for this first entry
-            self.retries.eq(0)
+            self.retries.eq(0),
+            self.tfrOctets.eq(0)
         ]
 
         # Filter for case someone tries to send us no transfers to perform
         # in which case we send back a good ack!
-        with m.If(self.rxBlock.bit_select(16,16)):
+        with m.If(rx.bit_select(16,16)):
+            # Set to one the number of responses sent back
+            self.txWrite(m, 1, C(1,16), 2)
             m.next = 'DAP_TransferBlock_PROCESS'
         with m.Else():
-            m.d.sync += [
-                self.txBlock.bit_select(8,24).eq(C(1,24)),
-                self.txLen.eq(4)
-            ]
+            self.txWrite(m, 1, C(1,24), 3)
             m.next = 'RESPOND'
 
     def RESP_TransferBlock_Process(self, m):
-        m.d.comb += self.tfrram.dat_w.eq(self.dbgif.dread)
+        # Only commit read data to the ram for transfers that will keep it
+        m.d.comb += self.tfrram.we.eq(Repl(self.dbg_latch & (~self.dbgif.ignoreData) & self.dbgif.rnw,4))
 
         # By default we don't want to receive any more stream data, we're not writing to the ram
         # and it's not the end of a packet
         m.d.sync += self.busy.eq(1)
 
+        # A block write has its data already in dwrite once it is issued, so while it is on the wire
+        # collect the data for the next one, which can then be issued as soon as this one completes
+        tookOctet = Signal()
+        with m.If((self.txb>=5) & ~self.dbgif.rnw & (self.transferCount>1) & (self.tfrOctets!=4)):
+            with m.If(self.streamOut.ready & self.streamOut.valid):
+                m.d.comb += tookOctet.eq(1)
+                m.d.sync += [
+                    self.tfrData.eq(Cat(self.tfrData[8:32],self.streamOut.payload)),
+                    self.tfrOctets.eq(self.tfrOctets+1),
+                    self.busy.eq(self.tfrOctets==3)
+                ]
+            with m.Else():
+                m.d.sync += self.busy.eq(0)
+
         with m.Switch(self.txb):
             with m.Case(0,1,2,3): # Collect the 32 bit transfer Data to go with the command ----------------------------
                 with m.If(self.streamOut.ready & self.streamOut.valid):
+                    # Octets arrive lsb first, so shift each one in from the top
+                    # Keep taking octets back to back until the last one of the word
                     m.d.sync+=[
-                        self.tfrData.word_select(self.txb,8).eq(self.streamOut.payload),
+                        self.tfrData.eq(Cat(self.tfrData[8:32],self.streamOut.payload)),
                         self.txb.eq(self.txb+1),
+                        self.busy.eq(self.txb==3)
                     ]
                 with m.Else():
                     m.d.sync +=self.busy.eq(0)
@@ -724,19 +931,28 @@ class CMSIS_DAP(Elaboratable):
 
             with m.Case(5): # Wait for command to be accepted ----------------------------------------------------------
                 with m.If(self.dbg_done==0):
-                    m.d.sync += self.dbgif.go.eq(0)
                     m.d.sync += self.txb.eq(6)
 
             with m.Case(6): # We sent a command, wait for it to start being executed -----------------------------------
                 with m.If(self.dbg_done==1):
                     # Write return value from this command into return frame
-                    m.d.sync += self.txBlock.bit_select(24,8).eq(Cat(self.dbgif.ack, self.dbgif.perr))
+                    self.txWrite(m, 3, Cat(self.dbgif.ack, self.dbgif.perr))
 
                     # Now lets figure out how to handle this response
 
+                    # Anything that doesn't need more data from the stream goes straight back out
+
                     # If we're to retry, then let's do it
                     with m.If(self.dbgif.ack==0b010):
-                        m.d.sync += self.txb.eq(Mux((self.retries<self.waitRetry),4,7))
+                        with m.If(self.retries<self.waitRetry):
+                            m.d.sync += [
+                                self.dbgif.go.eq(1),
+                                self.retries.eq(self.retries+1),
+                                self.txb.eq(5)
+                            ]
+                        with m.Else():
+                            m.d.sync += self.txb.eq(0)
+                            m.next = 'DAP_Transfer_Header'
 
                     with m.Else():
                         with m.If((~self.dbgif.ignoreData) & self.dbgif.rnw):
@@ -757,21 +973,41 @@ class CMSIS_DAP(Elaboratable):
                             # Keep going if appropriate
                             m.d.sync += self.transferCount.eq(self.transferCount-1)
                             with m.If((self.dbgif.ack==1) & (self.dbgif.perr==0) & (self.transferCount>1)):
-                                m.d.sync += [
-                                    self.retries.eq(0),
-                                    self.txBlock.bit_select(8,16).eq(self.txBlock.bit_select(8,16)+1),
-                                    self.txb.eq(Mux(self.dbgif.rnw,4,0))
-                                ]
+                                # Count this response, the ack goes in the same write
+                                self.txWrite(m, 1, Cat((self.txRead(m, 1, 2)+1)[:16], self.dbgif.ack, self.dbgif.perr), 3)
+                                with m.If(self.dbgif.rnw):
+                                    m.d.sync += [
+                                        self.dbgif.go.eq(1),
+                                        self.retries.eq(1),
+                                        self.txb.eq(5)
+                                    ]
+                                with m.Elif(self.tfrOctets==4):
+                                    # The next write was collected while this one ran, so send it straight out
+                                    m.d.sync += [
+                                        self.dbgif.dwrite.eq(self.tfrData),
+                                        self.dbgif.go.eq(1),
+                                        self.retries.eq(1),
+                                        self.tfrOctets.eq(0),
+                                        self.txb.eq(5)
+                                    ]
+                                with m.Else():
+                                    # ...otherwise carry on collecting it from wherever we got to
+                                    m.d.sync += [
+                                        self.retries.eq(0),
+                                        self.tfrOctets.eq(0),
+                                        self.txb.eq(self.tfrOctets+tookOctet)
+                                    ]
 
                             with m.Else():
                                 with m.If(self.dbgif.postedMode):
                                     # Debug interface is in posting mode, better do one more read to collect the data
                                     m.d.sync += [
                                         self.dbgif.rnw.eq(1),     # Read RDBUFF
-                                        self.retries.eq(0),
+                                        self.retries.eq(1),
                                         self.dbgif.apndp.eq(0),
                                         self.dbgif.addr32.eq(3),
-                                        self.txb.eq(4)
+                                        self.dbgif.go.eq(1),
+                                        self.txb.eq(5)
                                     ]
                                 with m.Else():
                                     # Otherwise lets wrap up
@@ -779,95 +1015,99 @@ class CMSIS_DAP(Elaboratable):
                                         # Only need to increment transfer count ram position if this was a read
                                         #self.transferCount.eq(self.tfrram.adr+self.dbgif.rnw),
                                         #self.tfrram.adr.eq(0),
-                                        self.txb.eq(7)
+                                        self.txb.eq(0)
                                     ]
+                                    m.next = 'DAP_Transfer_Header'
 
-            with m.Case(7,8,9,10): # Transfer completed, start sending data back ---------------------------------------
-                with m.If(self.streamIn.ready):
-                    m.d.sync += [
-                        self.streamIn.payload.eq(self.txBlock.word_select(self.txb-7,8)),
-                        self.streamIn.valid.eq(1),
-                        self.txb.eq(self.txb+1),
-                        # End of transfer if there are no data to return
-                        self.streamIn.last.eq(self.isV2 & (self.txb==10) & (self.dbgif.rnw==0))
-                    ]
-
-            with m.Case(11): # Initial data sent, decide what to do next ----------------------------------------------
+    def RESP_Transfer_Header(self, m):
+        # Send the txLen octets of response header built by either Transfer_Process or
+        # TransferBlock_Process, then hand over to send whatever was collected in the tfrram.
+        with m.If(self.txb!=self.txLen):
+            with m.If(self.streamIn.ready):
                 m.d.sync += [
-                    self.txb.eq(0),
-                    self.txedLen.eq((self.tfrram.adr*4)+4)  # Record length of data that will be returned
+                    self.streamIn.payload.eq(self.txRead(m, self.txb)),
+                    self.streamIn.valid.eq(1),
+                    self.txb.eq(self.txb+1),
+                    # End of transfer if there are no data to return
+                    self.streamIn.last.eq(self.isV2 & (self.txb==self.txLen-1) & (self.tfrram.adr==0))
                 ]
-                m.next = 'UPLOAD_RXED_DATA'
+        with m.Else():
+            m.d.sync += [
+                self.txb.eq(0),
+                self.tfrram.tx_adr.eq(0),
+                self.txedLen.eq((self.tfrram.adr*4)+self.txLen)  # Record length of data to be returned
+            ]
+            m.next = 'UPLOAD_RXED_DATA'
 
     def RESP_Transfer_Complete(self, m):
         # Complete the process of returning data collected via either Transfer_Process or
         # TransferBlock_Process. Data count to be transferred is in self.transferCount and
-        # the payload is in the tfrram.
+        # the payload is in the tfrram, which is read back through its tx port.
 
         m.d.sync += self.busy.eq(1)
 
         with m.Switch(self.txb):
             with m.Case(0): # Prepare transfer ------------------------------------------------------------------------
+                # The first word was addressed as the header finished, so it is only one cycle away
                 with m.If(self.tfrram.adr!=0):
                     m.d.sync += [
                         self.transferCount.eq(self.tfrram.adr),
-                        self.tfrram.adr.eq(0),
-                        self.txb.eq(1)
+                        self.txb.eq(2)
                         ]
                 with m.Else():
-                    m.d.sync += self.txb.eq(7)
+                    m.d.sync += self.txb.eq(8)
 
-            with m.Case(1): # Wait for ram to propagate through -------------------------------------------------------
-                m.d.sync += self.txb.eq(2)
+            with m.Case(2): # Wait for first word to propagate through ------------------------------------------------
+                m.d.sync += self.txb.eq(3)
 
-            with m.Case(2): # Collect transfer value from RAM store ---------------------------------------------------
+            with m.Case(3): # Collect transfer value from RAM store, and start fetching the next one -----------------
                 m.d.sync += [
                     self.transferCount.eq(self.transferCount-1),
-                    self.streamIn.payload.eq(self.tfrram.dat_r.word_select(0,8)),
-                    self.txb.eq(3)
+                    self.txShift.eq(self.tfrram.tx_dat_r),
+                    self.txFinal.eq(self.isV2 & (self.transferCount==1)),
+                    self.tfrram.tx_adr.eq(self.tfrram.tx_adr+1),
+                    self.txb.eq(4)
                 ]
 
-            with m.Case(3,4,5,6): # Send 32 bit value to outgoing stream -------------------------------------------
-                m.d.sync += self.streamIn.valid.eq(1)
-                with m.If(self.streamIn.ready & self.streamIn.valid):
+            with m.Case(4,5,6,7): # Send 32 bit value to outgoing stream -------------------------------------------
+                with m.If(self.streamIn.ready):
                     m.d.sync += [
                         self.txb.eq(self.txb+1),
-                        self.streamIn.payload.eq(self.tfrram.dat_r.word_select(self.txb-2,8)),
-                        # 5 because of pipeline
-                        self.streamIn.last.eq(self.isV2 & (self.transferCount==0) & (self.txb==5)),
-                        self.streamIn.valid.eq(self.txb!=6)
+                        # Octets go out lsb first, so shift each one down from the top
+                        self.streamIn.payload.eq(self.txShift[0:8]),
+                        self.txShift.eq(self.txShift[8:32]),
+                        self.streamIn.last.eq(self.txFinal & (self.txb==7)),
+                        self.streamIn.valid.eq(1)
                     ]
 
-            with m.Case(7): # Finished this send ---------------------------------------------------------------------
+            with m.Case(8): # Finished this send ---------------------------------------------------------------------
                 with m.If(self.streamIn.ready):
                     with m.If(self.transferCount==0):
-                        with (m.If(self.isV2)):# | (self.txedLen==DAP_V1_MAX_PACKET_SIZE))):
+                        with m.If(self.isV2):# | (self.txedLen==DAP_V1_MAX_PACKET_SIZE))):
                             m.next = 'IDLE'
                         with m.Else():
                             m.next = 'V1PACKETFILL'
                     with m.Else():
-                        m.d.sync += [
-                            self.txb.eq(1),
-                            self.tfrram.adr.eq(self.tfrram.adr+1)
-                        ]
+                        # Next word was fetched while this one was being sent
+                        m.d.sync += self.txb.eq(3)
 
     # -------------------------------------------------------------------------------------
     # -------------------------------------------------------------------------------------
     def RESP_JTAG_Sequence_Setup(self,m):
         # Triggered at the start of a RESP JTAG Sequence
         # There are data to receive at this point, and potentially bytes to transmit
+        rx = self.rxMessage(DAP_JTAG_Sequence)
 
         # Collect how many sequences we'll be processing, then move to get the first one
         m.d.sync += [
-            self.seqCount.eq(self.rxBlock.word_select(1,8)),
-
-            # Setup to have control over tms, tdi and swwr (set for output), with clocks of 1 clock cycle
-            self.dbgif.dwrite.eq(0),
+            self.seqCount.eq(rx.word_select(1,8)),
 
+            # Setup to have control over tms, tdi and swwr (set for output), with the TDI bits
+            # shifted out by the dbgif an octet at a time
             # Just for now take over reset as well
             self.dbgif.pinsin.eq(0b0001_0111_0001_0000),
-            self.dbgif.command.eq(CMD_PINS_WRITE),
-            self.txb.eq(0)
+            self.dbgif.command.eq(CMD_PINS_SHIFT),
+            self.seqState.eq(1<<0)
         ]
         m.next = 'DAP_JTAG_Sequence_PROCESS'
 
@@ -881,153 +1121,178 @@ class CMSIS_DAP(Elaboratable):
 
         m.d.sync += self.can.eq(0)
 
-        with m.Switch(self.txb):
-
-            # -------------- # Send frontmatter
-            with m.Case(0):
-                with m.If(self.streamIn.ready):
-                    m.d.sync += [
-                        # Send frontmatter for reponse
-                        self.streamIn.payload.eq(DAP_JTAG_Sequence),
-                        self.streamIn.last.eq(0),
-                        self.streamIn.valid.eq(1),
+        def nextOctet():
+            # If this was the last octet of the sequence go get the next, or finish
+            with m.If(self.tckCycles==0):
+                m.d.sync += self.seqState.eq(Mux(self.seqCount,1<<1,1<<5))
+            with m.Else():
+                m.d.sync += self.seqState.eq(1<<2)
 
-                        # This is the 'OK' that will be sent out next
-                        self.pendingTx.eq(0),
+        # The state is one-hot, so each step only has to look at its own bit
 
-                        # If there's nothing to be done then we are finished, otherwise start
-                        self.txb.eq(Mux(self.seqCount!=0,1,7))
-                    ]
+        # -------------- # Send frontmatter
+        with m.If(self.seqState[0]):
+            with m.If(self.streamIn.ready):
+                m.d.sync += [
+                    # Send frontmatter for reponse
+                    self.streamIn.payload.eq(DAP_JTAG_Sequence),
+                    self.streamIn.last.eq(0),
+                    self.streamIn.valid.eq(1),
 
-            # --------------
-            with m.Case(1): # Get info for this sequence
-                with m.If(self.streamOut.ready & self.streamOut.valid):
-                    m.d.sync += [
-                        self.seqCount.eq(self.seqCount-1),
-                        self.tckCycles.eq(self.streamOut.payload.bit_select(0,6)),
+                    # This is the 'OK' that will be sent out next
+                    self.pendingTx.eq(0),
 
-                        # Set the TMS bit
-                        self.dbgif.pinsin.bit_select(1,1).eq(self.streamOut.payload.bit_select(6,1)),
+                    # If there's nothing to be done then we are finished, otherwise start
+                    self.seqState.eq(Mux(self.seqCount!=0,1<<1,1<<5))
+                ]
 
-                        # ...and decide if we want to capture what comes back
-                        self.tdotgt.eq(Mux(self.streamOut.payload.bit_select(7,1),
-                                           Mux(self.streamOut.payload.bit_select(0,6),self.streamOut.payload.bit_select(0,6),0x40),0)),
+        # --------------
+        with m.If(self.seqState[1]): # Get info for this sequence
+            with m.If(self.streamOut.ready & self.streamOut.valid):
+                m.d.sync += [
+                    self.seqCount.eq(self.seqCount-1),
+                    self.tckCycles.eq(self.streamOut.payload.bit_select(0,6)),
 
-                        self.txb.eq(2)
-                    ]
-                with m.Else():
-                    m.d.sync += self.busy.eq(0)
+                    # Set the TMS bit
+                    self.dbgif.pinsin.bit_select(1,1).eq(self.streamOut.payload.bit_select(6,1)),
 
-            # --------------
-            with m.Case(2): # Waiting for TDI byte to arrive
-                with m.If(self.streamOut.ready & self.streamOut.valid):
-                    m.d.sync += [
-                        self.tdiData.eq(self.streamOut.payload),
-                        self.tdiCount.eq(0),
+                    # ...and decide if we want to capture what comes back
+                    self.tdoCapture.eq(self.streamOut.payload.bit_select(7,1)),
 
-                        self.txb.eq(3)
-                    ]
-                with m.Else():
-                    m.d.sync += self.busy.eq(0)
+                    # The TDI octet follows straight on, so stay ready for it
+                    self.busy.eq(0),
+                    self.seqState.eq(1<<2)
+                ]
+            with m.Else():
+                m.d.sync += self.busy.eq(0)
 
-            # --------------
-            with m.Case(3): # Setup for clocking out TDI, TCK->0
+        # --------------
+        with m.If(self.seqState[2]): # Wait for TDI byte, then clock out up to eight bits of it, capturing TDO as they go
+            with m.If(self.streamOut.ready & self.streamOut.valid):
                 m.d.sync += [
-                    # Put this bit ready to output
-                    self.dbgif.pinsin.bit_select(2,1).eq(self.tdiData.bit_select(self.tdiCount,1)),
-                    self.dbgif.pinsin.bit_select(0,1).eq(0),
+                    self.dbgif.dwrite.eq(Cat(self.streamOut.payload,C(1,1))),
+                    self.dbgif.bitcount.eq(Mux((self.tckCycles==0) | (self.tckCycles>8),8,self.tckCycles)),
                     self.dbgif.go.eq(1),
+                    self.tckCycles.eq(Mux((self.tckCycles==0) | (self.tckCycles>8),self.tckCycles-8,0)),
 
-                    self.txb.eq(4)
+                    self.seqState.eq(1<<3)
                 ]
-
-            # -------------
-            with m.Case(4): # Waiting until we can set TCK->1
-                with m.If(self.dbg_done==0):
-                    m.d.sync += self.dbgif.go.eq(0)
-                with m.If ((self.dbgif.go==0) & (self.dbg_done==1)):
-                    m.d.sync += [
-                        # Bit is established, change the clock
-                        self.dbgif.pinsin.bit_select(0,1).eq(1),
-                        self.dbgif.go.eq(1),
-
-                        self.txb.eq(5)
-                    ]
-
-            # -------------
-            with m.Case(5): # Sent this bit, waiting for clock 1 to complete
-                with m.If(self.dbg_done==0):
-                    m.d.sync += self.dbgif.go.eq(0)
-                with m.If ((self.dbgif.go==0) & (self.dbg_done==1)):
-                    m.d.sync += [
-                        # Adjust all the pointers
-                        self.tckCycles.eq(self.tckCycles-1),
-                        self.tdiCount.eq(self.tdiCount+1),
-
-                        self.txb.eq(6)
-                    ]
-
-                    # If there is a capture in process then do it
-                    with m.If(self.tdotgt):
-                        m.d.sync += [
-                            self.can.eq(self.dbgif.pinsout.bit_select(3,1)),
-                            self.tdoBuild.bit_select(self.tdoCount,1).eq(self.dbgif.pinsout.bit_select(3,1)),
-                            self.tdoCount.eq(self.tdoCount+1),
-                            self.tdotgt.eq(self.tdotgt-1)
-                        ]
-
-            # -------------
-            with m.Case(6): # ...if this capture is complete then send it back, then decide if there is still work to be done
-                with m.If(((self.tdotgt==0) & (self.tdoCount!=0)) | (self.tdoCount==8)):
-                    with m.If(self.streamIn.ready):
-                        m.d.sync += [
-                            self.streamIn.payload.eq(self.pendingTx),
-                            self.streamIn.valid.eq(1),
-                            self.pendingTx.eq(self.tdoBuild),
-                            self.tdoCount.eq(0),
-                            self.tdoBuild.eq(0)
-                        ]
+            with m.Else():
+                m.d.sync += self.busy.eq(0)
+
+        # -------------
+        with m.If(self.seqState[3]): # Waiting for the octet to be clocked out
+            with m.If ((self.dbgif.go==0) & (self.dbg_done==1)):
+                with m.If(self.tdoCapture):
+                    m.d.sync += self.seqState.eq(1<<4)
                 with m.Else():
-                    with m.If(self.tckCycles==0):
-                        # This is the last bit of the sequence, go get the next, or finish
-                        m.d.sync += self.txb.eq(Mux(self.seqCount,1,7))
-                    with m.Else():
-                        # otherwise set up the next bit to clock out, or a new byte
-                        m.d.sync += self.txb.eq(Mux(self.tdiCount==8,2,3))
+                    nextOctet()
 
-            # -------------
-            with m.Case(7): # Send the final byte, with last set
-                with m.If(self.streamIn.ready):
-                    m.d.sync += [
-                        self.streamIn.payload.eq(self.pendingTx),
-                        self.streamIn.last.eq(1),
-                        self.streamIn.valid.eq(1)
-                    ]
-                    m.next = 'IDLE'
+        # -------------
+        with m.If(self.seqState[4]): # Send back the previous octet, and keep this capture for sending later
+            with m.If(self.streamIn.ready):
+                m.d.sync += [
+                    self.streamIn.payload.eq(self.pendingTx),
+                    self.streamIn.valid.eq(1),
+                    self.pendingTx.eq(self.dbgif.dread.bit_select(0,8)),
+                    self.can.eq(self.dbgif.dread.bit_select(0,1))
+                ]
+                nextOctet()
+
+        # -------------
+        with m.If(self.seqState[5]): # Send the final byte, with last set
+            with m.If(self.streamIn.ready):
+                m.d.sync += [
+                    self.streamIn.payload.eq(self.pendingTx),
+                    self.streamIn.last.eq(1),
+                    self.streamIn.valid.eq(1)
+                ]
+                m.next = 'IDLE'
 
 
     # -------------------------------------------------------------------------------------
 
     def elaborate(self,platform):
-        done_cdc      = Signal(2)
-        self.dbg_done = Signal()
+        done_cdc       = Signal(2)
+        self.dbg_done  = Signal()
+        self.dbg_latch = Signal()
 
         m = Module()
         # Reset everything before we start
 
-        m.d.sync += self.streamIn.valid.eq(0)
+        m.d.sync += [ self.streamIn.valid.eq(0), self.txFill.eq(0) ]
         m.d.comb += self.streamOut.ready.eq(~self.busy)
 
+        # Responses go out through a small fifo. Writes to streamIn are registered, so a state
+        # which sees ready can write in the following cycle, and ready keeps one entry free
+        # for that write. This keeps the host side ready out of the state logic.
+        # A V1 packet is zero filled by a single fill entry, which is repeated on the way out
+        # until the packet is complete, so the state machine doesn't wait for the padding.
+        # A V2 response that ends on a USB packet boundary is padded on the way out too, so
+        # whichever state sent it, the host gets a short packet rather than waiting for more.
+        # Its final entry goes out without last and is then repeated as a zero pad octet. A
+        # response of the full DAP packet size is complete as it stands, so it isn't padded.
+        m.submodules.txfifo = txFifo = SyncFIFOBuffered(width=10, depth=TX_FIFO_DEPTH)
+        txPad = Signal()
+        m.d.comb += [
+            txPad.eq(self.isV2 & txFifo.r_data[8] & ~self.txPadding &
+                     (self.txSent[:USB_MAX_PACKET_SIZE.bit_length()-1]==USB_MAX_PACKET_SIZE-1) &
+                     (self.txSent!=DAP_V2_MAX_PACKET_SIZE-1)),
+
+            txFifo.w_data.eq(Cat(self.streamIn.payload, self.streamIn.last, self.txFill)),
+            txFifo.w_en.eq(self.streamIn.valid),
+            self.streamIn.ready.eq(txFifo.level<TX_FIFO_DEPTH-1),
+
+            self.usbIn.payload.eq(Mux(self.txPadding,0,txFifo.r_data[0:8])),
+            self.usbIn.last.eq(txFifo.r_data[8] & ~txPad),
+            self.usbIn.valid.eq(txFifo.r_rdy),
+            txFifo.r_en.eq(self.usbIn.ready & ~txPad & (~txFifo.r_data[9] | (self.txFilled==DAP_V1_MAX_PACKET_SIZE-1)))
+        ]
+
+        with m.If(self.isV2):
+            m.d.sync += self.txFilled.eq(0)
+        with m.Elif(self.usbIn.valid & self.usbIn.ready):
+            m.d.sync += self.txFilled.eq(Mux(self.txFilled==DAP_V1_MAX_PACKET_SIZE-1,0,self.txFilled+1))
+
+        with m.If(~self.isV2):
+            m.d.sync += [ self.txSent.eq(0), self.txPadding.eq(0) ]
+        with m.Elif(self.usbIn.valid & self.usbIn.ready):
+            m.d.sync += [
+                self.txSent.eq(Mux(self.usbIn.last,0,self.txSent+1)),
+                self.txPadding.eq(txPad)
+            ]
+
         m.submodules.tfrram = self.tfrram = WideRam()
 
+        infoRom = Memory(width=8, depth=len(INFO_ROM), init=list(INFO_ROM))
+        m.submodules.inforom = self.infoRom = infoRom.read_port(domain="comb")
+
+        infoDispatch = Memory(width=10, depth=len(INFO_DISPATCH), init=INFO_DISPATCH)
+        m.submodules.infodispatch = self.infoDispatch = infoDispatch.read_port(domain="comb")
+
+        cmdDispatch = Memory(width=9, depth=len(DAP_DISPATCH), init=DAP_DISPATCH)
+        m.submodules.cmddispatch = self.cmdDispatch = cmdDispatch.read_port(domain="comb")
+
+        m.submodules.txwr = self.txWr = self.txMem.write_port(granularity=8)
+        m.submodules.txrd = self.txRd = self.txMem.read_port(domain="comb")
+
         m.submodules.dbgif = self.dbgif = DBGIF(self.dbgpins)
 
         # Organise the CDC from the debug interface
         m.d.sync += done_cdc.eq(Cat(done_cdc[1],self.dbgif.done))
         m.d.comb += self.dbg_done.eq(done_cdc==0b11)
 
-        # Latch the read data at the rising edge of done signal
-        m.d.comb += self.tfrram.we.eq(done_cdc==0b10)
+        # States just raise go to issue a command. Once the dbgif has picked it up it drops
+        # done, and go is dropped again here, ready for the state to see the command complete.
+        with m.If(self.dbg_done==0):
+            m.d.sync += self.dbgif.go.eq(0)
+
+        # Read data are latched at the rising edge of done signal, the transfer states
+        # decide whether they are kept
+        m.d.comb += [
+            self.dbg_latch.eq(done_cdc==0b10),
+            self.tfrram.dat_w.eq(self.dbgif.dread)
+        ]
 
         with m.FSM(domain="sync") as decoder:
             with m.State('IDLE'):
@@ -1037,78 +1302,45 @@ class CMSIS_DAP(Elaboratable):
                 with m.If(self.streamOut.valid & self.streamOut.ready & self.streamOut.first):
                     m.next = 'ProtocolError'
                     m.d.sync += self.rxedLen.eq(1)
-                    m.d.sync += self.rxBlock.word_select(0,8).eq(self.streamOut.payload)
+                    m.d.sync += self.rxBlock.eq(Cat(self.rxBlock[8:],self.streamOut.payload))
 
                     # Default return is packet name followed by 0 (no error)
-                    m.d.sync += self.txBlock.word_select(0,16).eq(Cat(self.streamOut.payload,C(0,8)))
-                    m.d.sync += self.txLen.eq(2)
-
-                    with m.Switch(self.streamOut.payload):
-                        with m.Case(DAP_Disconnect, DAP_ResetTarget, DAP_SWO_Status, DAP_TransferAbort):
-                            m.d.sync+= [ self.rxLen.eq(1), self.busy.eq(1) ]
-                            # This still goes to RxParams as a common entry, but then it dispatches immediately
-                            # from there as there are no params to rx
-                            m.next='RxParams'
-
-                        with m.Case(DAP_Info, DAP_Connect, DAP_SWD_Configure, DAP_SWO_Transport, DAP_SWJ_Sequence,
-                                    DAP_SWO_Mode, DAP_SWO_Control, DAP_SWO_ExtendedStatus, DAP_JTAG_IDCODE, DAP_JTAG_Sequence):
-                            m.d.sync+=self.rxLen.eq(2)
-                            with m.If(~self.streamOut.last):
-                                m.next = 'RxParams'
-
-                        with m.Case(DAP_HostStatus, DAP_SWO_Data, DAP_Delay, DAP_JTAG_Configure, DAP_Transfer):
-                            m.d.sync+=self.rxLen.eq(3)
-                            with m.If(~self.streamOut.last):
-                                m.next = 'RxParams'
-
-                        with m.Case(DAP_SWO_Baudrate, DAP_SWJ_Clock, DAP_TransferBlock):
-                            m.d.sync+=self.rxLen.eq(5)
-                            with m.If(~self.streamOut.last):
-                                m.next = 'RxParams'
-
-                        with m.Case(DAP_WriteABORT, DAP_TransferConfigure):
-                            m.d.sync+=self.rxLen.eq(6)
-                            with m.If(~self.streamOut.last):
-                                m.next = 'RxParams'
-
-                        with m.Case(DAP_SWJ_Pins):
-                            m.d.sync+=self.rxLen.eq(7)
-                            with m.If(~self.streamOut.last):
-                                m.next = 'RxParams'
-
-                        with m.Case(DAP_SWD_Sequence):
-                            with m.If(~self.streamOut.last):
-                                m.next = 'DAP_SWD_Sequence_GetCount'
-
-                        with m.Case(DAP_ExecuteCommands):
-                            with m.If(~self.streamOut.last):
-                                m.next = 'DAP_ExecuteCommands_GetNum'
-
-                        with m.Case(DAP_QueueCommands):
-
-                            with m.If(~self.streamOut.last):
-                                m.next = 'DAP_QueueCommands_GetNum'
-
-                        with m.Default():
-                            self.RESP_Invalid(m)
+                    self.txWrite(m, 0, Cat(self.streamOut.payload,C(0,8)), 2)
+                    m.d.sync += [ self.txLen.eq(2), self.waitLatchPerr.eq(1) ]
+
+                    # Find out how much to receive, and who is to deal with it
+                    m.d.comb += self.cmdDispatch.addr.eq(self.streamOut.payload)
+                    entry = self.cmdDispatch.data
+                    m.d.sync += [
+                        self.rxLen.eq(entry[5:8]),
+                        self.cmdHandler.eq(entry[0:5])
+                    ]
+
+                    with m.If(~entry[8]):
+                        self.RESP_Invalid(m)
+
+                    with m.Elif(entry[5:8]==1):
+                        m.d.sync += self.busy.eq(1)
+                        # This still goes to RxParams as a common entry, but then it dispatches immediately
+                        # from there as there are no params to rx
+                        m.next='RxParams'
+
+                    with m.Elif(~self.streamOut.last):
+                        m.next = 'RxParams'
 
     #########################################################################################
 
             with m.State('RESPOND'):
                 with m.If(self.txedLen<self.txLen):
-                    m.d.sync += [
-                        self.streamIn.valid.eq(1),
-                        self.streamIn.payload.eq(self.txBlock.word_select(self.txedLen,8)),
-
-                        # This is the end of the packet if we've filled the length and it's v2
-                        # or if we've filled the packet and it's v1
-                        self.streamIn.last.eq(self.isV2 & (self.txedLen==self.txLen-1)),
-                    ]
-
-                    with m.If(self.streamIn.ready & self.streamIn.valid):
+                    with m.If(self.streamIn.ready):
                         m.d.sync += [
-                            self.txedLen.eq(self.txedLen+1),
-                            self.streamIn.valid.eq(0)
+                            self.streamIn.valid.eq(1),
+                            self.streamIn.payload.eq(self.txRead(m, self.txedLen)),
+
+                            # This is the end of the packet if we've filled the length and it's v2
+                            # or if we've filled the packet and it's v1
+                            self.streamIn.last.eq(self.isV2 & (self.txedLen==self.txLen-1)),
+                            self.txedLen.eq(self.txedLen+1)
                         ]
 
                 with m.Elif(self.isV2 | (self.txedLen==DAP_V1_MAX_PACKET_SIZE)):
@@ -1124,25 +1356,18 @@ class CMSIS_DAP(Elaboratable):
 
             with m.State('V1PACKETFILL'):
                 with m.If(self.txedLen<DAP_V1_MAX_PACKET_SIZE):
-                    m.d.sync += [
-                        self.streamIn.valid.eq(1),
-                        self.streamIn.payload.eq(0),
-                    ]
-
-                    with m.If(self.txedLen<DAP_V1_MAX_PACKET_SIZE-1):
-                        with m.If(self.streamIn.ready & self.streamIn.valid):
-                            m.d.sync += [
-                                self.txedLen.eq(self.txedLen+1),
-                                self.streamIn.valid.eq(0)
-                            ]
-                    with m.Else():
-                        self.streamIn.valid.eq(0),
-                        self.busy.eq(0)
+                    # One fill entry pads out the rest of the packet as it leaves the fifo
+                    with m.If(self.streamIn.ready):
+                        m.d.sync += [
+                            self.streamIn.valid.eq(1),
+                            self.streamIn.payload.eq(0),
+                            self.txFill.eq(1),
+                            self.busy.eq(0)
+                        ]
                         m.next = 'IDLE'
 
                 with m.Else():
-                    self.streamIn.valid.eq(0),
-                    self.busy.eq(0)
+                    m.d.sync += self.busy.eq(0)
                     m.next = 'IDLE'
 
     #########################################################################################
@@ -1151,99 +1376,16 @@ class CMSIS_DAP(Elaboratable):
                 # ---- Action dispatcher --------------------------------------
                 # If we've got everything for this packet then let's process it
                 with m.If(self.rxedLen==self.rxLen):
-                    with m.Switch(self.rxBlock.word_select(0,8)):
-
-                        # General Commands
-                        # ================
-                        with m.Case(DAP_Info):
-                            self.RESP_Info(m)
-
-                        with m.Case(DAP_HostStatus):
-                            self.RESP_HostStatus(m)
-
-                        with m.Case(DAP_Connect):
-                            self.RESP_Connect_Setup(m)
-
-                        with m.Case(DAP_Disconnect):
-                            self.RESP_Disconnect(m)
-
-                        with m.Case(DAP_WriteABORT):
-                            self.RESP_WriteABORT(m)
-
-                        with m.Case(DAP_Delay):
-                            self.RESP_Delay(m)
-
-                        with m.Case(DAP_ResetTarget):
-                            self.RESP_ResetTarget(m)
-
-                        # Common SWD/JTAG Commands
-                        # ========================
-                        with m.Case(DAP_SWJ_Pins):
-                            self.RESP_SWJ_Pins_Setup(m)
-
-                        with m.Case(DAP_SWJ_Clock):
-                            self.RESP_SWJ_Clock(m)
-
-                        with m.Case(DAP_SWJ_Sequence):
-                            self.RESP_SWJ_Sequence_Setup(m)
-
-                        # SWD Commands
-                        # ============
-                        with m.Case(DAP_SWD_Configure):
-                            self.RESP_SWD_Configure(m)
-
-                        # SWO Commands
-                        # ============
-                        with m.Case(DAP_SWO_Transport):
-                            self.RESP_Not_Implemented(m)
-
-                        with m.Case(DAP_SWO_Mode):
-                            self.RESP_Not_Implemented(m)
-
-                        with m.Case(DAP_SWO_Baudrate):
-                            self.RESP_Not_Implemented(m)
-
-                        with m.Case(DAP_SWO_Control):
-                            self.RESP_Not_Implemented(m)
-
-                        with m.Case(DAP_SWO_Status):
-                            self.RESP_Not_Implemented(m)
-
-                        with m.Case(DAP_SWO_ExtendedStatus):
-                            self.RESP_Not_Implemented(m)
-
-                        with m.Case(DAP_SWO_Data):
-                            self.RESP_Not_Implemented(m)
-
-                        # JTAG Commands
-                        # =============
-                        with m.Case(DAP_JTAG_Sequence):
-                            self.RESP_JTAG_Sequence_Setup(m)
-
-                        with m.Case(DAP_JTAG_Configure):
-                            self.RESP_JTAG_Configure(m)
-
-                        with m.Case(DAP_JTAG_IDCODE):
-                            self.RESP_JTAG_IDCODE_Setup(m)
-
-                        # Transfer Commands
-                        # =================
-                        with m.Case(DAP_TransferConfigure):
-                            self.RESP_TransferConfigure(m)
-
-                        with m.Case(DAP_Transfer):
-                            self.RESP_Transfer_Setup(m)
-
-                        with m.Case(DAP_TransferBlock):
-                            self.RESP_TransferBlock_Setup(m)
-
-                        with m.Default():
-                            self.RESP_Invalid(m)
+                    # Hand over to whichever handler the dispatch rom picked out for this command
+                    with m.Switch(self.cmdHandler):
+                        for index, handler in enumerate(DAP_HANDLERS):
+                            with m.Case(index):
+                                getattr(self, handler)(m)
 
                 # Grab next byte in this packet
                 with m.Elif(self.streamOut.valid & self.streamOut.ready):
                     m.d.sync += [
-                        self.rxBlock.word_select(self.rxedLen,8).eq(self.streamOut.payload),
+                        self.rxBlock.eq(Cat(self.rxBlock[8:],self.streamOut.payload)),
                         self.rxedLen.eq(self.rxedLen+1)
                     ]
                     # Don't grab more data if we've got what we were commanded for
@@ -1258,6 +1400,9 @@ class CMSIS_DAP(Elaboratable):
 
     #########################################################################################
 
+            with m.State('DAP_Info_Stream'):
+                self.RESP_Info_Stream(m)
+
             with m.State('DAP_SWJ_Pins_PROCESS'):
               self.RESP_SWJ_Pins_Process(m)
 
@@ -1267,6 +1412,9 @@ class CMSIS_DAP(Elaboratable):
             with m.State('DAP_SWJ_Sequence_PROCESS'):
                 self.RESP_SWJ_Sequence_Process(m)
 
+            with m.State('DAP_JTAG_Configure_PROCESS'):
+                self.RESP_JTAG_Configure_Process(m)
+
             with m.State('DAP_JTAG_Sequence_PROCESS'):
               self.RESP_JTAG_Sequence_PROCESS(m)
 
@@ -1276,30 +1424,21 @@ class CMSIS_DAP(Elaboratable):
             with m.State('DAP_TransferBlock_PROCESS'):
               self.RESP_TransferBlock_Process(m)
 
+            with m.State('DAP_Transfer_Header'):
+              self.RESP_Transfer_Header(m)
+
             with m.State('UPLOAD_RXED_DATA'):
               self.RESP_Transfer_Complete(m)
 
             with m.State('JTAG_IDCODE_Process'):
               self.RESP_JTAG_IDCODE_Process(m)
 
-            with m.State('DAP_SWD_Sequence_GetCount'):
-                self.RESP_Invalid(m)
-
             with m.State('DAP_TransferBlock'):
                 self.RESP_Invalid(m)
 
-            with m.State('DAP_ExecuteCommands_GetNum'):
-                self.RESP_Invalid(m)
-
-            with m.State('DAP_QueueCommands_GetNum'):
-                self.RESP_Invalid(m)
-
             with m.State('DAP_Wait_Done'):
                 self.RESP_Wait_Done(m)
 
-            with m.State('DAP_Wait_Connect_Done'):
-                self.RESP_Wait_Connect_Done(m)
-
             with m.State('Error'):
                 self.RESP_Invalid(m)
 
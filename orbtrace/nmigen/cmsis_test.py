@@ -60,10 +60,10 @@ tests2 = (
     ( "FW version",                 b"\x00\x04",                    b"\x00\x05\x31\x2e\x30\x30\x00" ),
     ( "Illegal command",            b"\x42",                        b"\xff"                     ),
     ( "Request CAPABILITIES",       b"\x00\xf0",                    b"\x00\x01\x01"             ),
-    ( "Request TEST DOMAIN TIMER",  b"\x00\xf1",                    b"\x00\x08\x00\xca\x9a\x3b" ),
+    ( "Request TEST DOMAIN TIMER",  b"\x00\xf1",                    b"\x00\x04\x00\xca\x9a\x3b" ),
     ( "Request SWO Trace Buffer Size", b"\x00\xfd",                 b"\x00\x04\xe8\x03\x00\x00" ),
-    ( "Request Packet Count",       b"\x00\xFE",                    b"\x00\x01\x40"             ),
-    ( "Request Packet Size",        b"\x00\xff",                    b"\x00\x02\x40\x00"         ),
+    ( "Request Packet Count",       b"\x00\xFE",                    b"\x00\x01\x01"             ),
+    ( "Request Packet Size",        b"\x00\xff",                    b"\x00\x02\x00\x04"         ),
     ( "Set connect led",            b"\x01\x00\x01",                b"\x01\x00"                 ),
     ( "Set running led",            b"\x01\x01\x01",                b"\x01\x00"                 ),
     ( "Set illegal led",            b"\x01\x02\x01",                b"\xff"                     ),
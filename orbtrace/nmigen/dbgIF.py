@@ -26,7 +26,8 @@ class DBGIF(Elaboratable):
         self.ack          = Signal(3);
         self.pinsin       = Signal(16);
         self.pinsout      = Signal(8);
-        self.command      = Signal(4);
+        self.command      = Signal(16);
+        self.bitcount     = Signal(4);
         self.canary       = Signal();
         self.dev          = Signal(3);
 
@@ -68,6 +69,7 @@ class DBGIF(Elaboratable):
             i_dwrite     = self.dwrite,
             o_dread      = self.dread,
             i_pinsin     = self.pinsin,
+            i_bitcount   = self.bitcount,
             o_pinsout    = self.pinsout,
             o_canary     = self.canary,
 
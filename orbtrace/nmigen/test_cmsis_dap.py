@@ -0,0 +1,39 @@
+#SPDX-License-Identifier: BSD-3-Clause
+
+import unittest
+
+from nmigen                  import *
+from nmigen.hdl.rec          import Record
+from nmigen.lib.io           import pin_layout
+from nmigen.back             import rtlil
+
+from .cmsis_dap              import CMSIS_DAP
+
+# The dbgif pins as requested from the platform by orbtrace_builder_nmigen
+dbgpins_layout = [
+    ("tck_swclk",    pin_layout(1, "o")),
+    ("nvdriveen",    pin_layout(1, "o")),
+    ("swdwr",        pin_layout(1, "o",  xdr=1)),
+    ("reseten",      pin_layout(1, "o")),
+    ("nvsen",        pin_layout(1, "o")),
+    ("tdi",          pin_layout(1, "o",  xdr=1)),
+    ("tms_swdio",    pin_layout(1, "io", xdr=1)),
+    ("tdo_swo",      pin_layout(1, "i",  xdr=1)),
+    ("nreset_sense", pin_layout(1, "i")),
+]
+
+stream_layout = [ ("payload", 8), ("valid", 1), ("ready", 1), ("first", 1), ("last", 1) ]
+
+class CMSIS_DAPTestCase(unittest.TestCase):
+    def test_elaborate(self):
+        m = Module()
+        m.domains.sync  = ClockDomain("sync")
+        m.domains.sys2x = ClockDomain("sys2x")
+        m.submodules.dap = CMSIS_DAP(Record(stream_layout), Record(stream_layout),
+                                     Record(dbgpins_layout), Signal())
+
+        # Lowering to RTLIL elaborates every submodule and checks the generated netlist
+        rtlil.convert(m)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,6 +13,7 @@
 // Commands are loaded by putting the command id into command, setting any registers and then
 // taking 'go' true. 'done' will go false when the command has started, then go should be
 // returned false. 'done' will go true when the command completes. err will be set for errors.
+// Command ids are one-hot, so each command is selected by a single bit of command.
 // For streams (specifically CMD_TRANSACT only) 'go' can be taken true again to prime the next
 // transfer.
 //
@@ -35,6 +36,14 @@
 //                           6            nRESET_STATE     SPEC EXTENSION
 //                           7      Y     nRESET
 //
+//  CMD_PINS_SHIFT  : As CMD_PINS_WRITE, but clock bitcount (1..8) bits out of dwrite[7:0] onto
+//                    SWDIO, lsb first, with one full SWCLK cycle per bit. If dwrite[8] is set
+//                    the bits go out on TDI instead, with SWDIO/TMS set from pinsin. Pins other
+//                    than SWCLK and the shifted one are set from pinsin as for CMD_PINS_WRITE.
+//                    SWCLK is left high and the shifted pin holds the last bit until the next
+//                    CMD_PINS_WRITE. TDO is sampled at each rising edge of SWCLK and returned,
+//                    lsb first, in dread[7:0].
+//
 //  CMD_TRANSACT    : Execute command transaction on target interface.
 //                          addr32  Bits 2 & 3 of address
 //                          rnw     Read(1) not Write(0)
@@ -75,7 +84,7 @@
 //                    interface pins with CMD_SET_SWJ etc.)
 //
 
-module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, parameter DEFAULT_RST_TIMEOUT_USEC=300) (
+module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, parameter DEFAULT_RST_TIMEOUT_USEC=300, parameter TICKS_PER_USEC=CLK_FREQ/1000000) (
 		input             rst,
                 input             clk,
 
@@ -105,10 +114,11 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
                 input  [31:0]     dwrite,          // Most recent data or parameter to write
                 output [31:0]     dread,           // Data read from target
                 input  [15:0]     pinsin,          // Pin setting information to target (upper 8 bits mask)
+                input  [3:0]      bitcount,        // Number of bits to shift out for CMD_PINS_SHIFT (1..8)
                 output [7:0]      pinsout,         // Pin information from target
 
         // Event triggers and responses
-                input [3:0]       command,         // Command to be performed
+                input [15:0]      command,         // Command to be performed (one-hot)
                 input             go,              // Trigger
                 output            done,            // Response
                 output reg        perr,            // Indicator of a error in the transfer
@@ -125,25 +135,25 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
                 output reg        again            // Take the data returned from this call as last AP read, then repeat the request
 	      );
 
-   parameter TICKS_PER_USEC=CLK_FREQ/1000000;
    parameter DEFAULT_IF_TICKS_PER_CLK=((CLK_FREQ+(DEFAULT_SWCLK>>1))/(DEFAULT_SWCLK<<1))-1;
 
-   // Control commands
-   parameter CMD_RESET       = 0;
-   parameter CMD_PINS_WRITE  = 1;
-   parameter CMD_TRANSACT    = 2;
-   parameter CMD_SET_SWD     = 3;
-   parameter CMD_SET_JTAG    = 4;
-   parameter CMD_SET_SWJ     = 5;
-   parameter CMD_SET_JTAG_CFG= 6;
-   parameter CMD_SET_CLK     = 7;
-   parameter CMD_SET_SWD_CFG = 8;
-   parameter CMD_WAIT        = 9;
-   parameter CMD_CLR_ERR     = 10;
-   parameter CMD_SET_RST_TMR = 11;
-   parameter CMD_SET_TFR_CFG = 12;
-   parameter CMD_JTAG_GET_ID = 13;
-   parameter CMD_JTAG_RESET  = 14;
+   // Control commands (one-hot, so each is decoded by a single bit of command)
+   parameter CMD_RESET       = 16'h0001;
+   parameter CMD_PINS_WRITE  = 16'h0002;
+   parameter CMD_TRANSACT    = 16'h0004;
+   parameter CMD_SET_SWD     = 16'h0008;
+   parameter CMD_SET_JTAG    = 16'h0010;
+   parameter CMD_SET_SWJ     = 16'h0020;
+   parameter CMD_SET_JTAG_CFG= 16'h0040;
+   parameter CMD_SET_CLK     = 16'h0080;
+   parameter CMD_SET_SWD_CFG = 16'h0100;
+   parameter CMD_WAIT        = 16'h0200;
+   parameter CMD_CLR_ERR     = 16'h0400;
+   parameter CMD_SET_RST_TMR = 16'h0800;
+   parameter CMD_SET_TFR_CFG = 16'h1000;
+   parameter CMD_JTAG_GET_ID = 16'h2000;
+   parameter CMD_JTAG_RESET  = 16'h4000;
+   parameter CMD_PINS_SHIFT  = 16'h8000;
 
    // Commands down to JTAG layer
    parameter JTAG_CMD_IR     = 0;    // Set IR
@@ -189,6 +199,12 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
    reg [8:0]                      state_step;      // Stepping through comms states
    reg                            readRDBUFF;      // Flag to read RDBUFF rather than commanded register
    reg                            old_tgtclk;      // Historic swclock to see when an edge occured
+   reg [7:0]                      shiftreg;        // Bits being shifted out by CMD_PINS_SHIFT
+   reg [3:0]                      shiftcount;      // Number of bits left to shift out
+   reg                            pinw_shifted;    // Set when a pin is driven from shiftreg
+   reg                            pinw_shiftdi;    // Set when that pin is TDI, rather than SWDIO
+   reg [3:0]                      shiftpad;        // Shifts to right justify a short TDO capture
+   reg [7:0]                      tdoshift;        // TDO bits captured by CMD_PINS_SHIFT
 
    parameter ST_DBG_IDLE                 = 0;
    parameter ST_DBG_RESETTING            = 1;
@@ -201,6 +217,7 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
    parameter ST_DBG_WAIT_CLKCHANGE       = 8;
    parameter ST_DBG_ESTABLISH_MODE       = 9;
    parameter ST_DBG_CALC_DIV             = 10;
+   parameter ST_DBG_PINSHIFT             = 11;
 
    // Pins driven by swd (MODE_SWD)
    wire                           swd_swdo;
@@ -225,9 +242,9 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
 
    // Pins driven by pin_write (MODE_SWJ)
    wire                           pinw_nreset = pinsin[8+7]?pinsin[7]:1;
-   wire                           pinw_tdi    = pinsin[8+2]?pinsin[2]:1;
+   wire                           pinw_tdi    = (pinw_shifted && pinw_shiftdi)?shiftreg[0]:pinsin[8+2]?pinsin[2]:1;
    wire                           pinw_swwr   = pinsin[8+4]?pinsin[4]:0;
-   wire                           pinw_swdo   = pinsin[8+1]?pinsin[1]:0;
+   wire                           pinw_swdo   = (pinw_shifted && !pinw_shiftdi)?shiftreg[0]:pinsin[8+1]?pinsin[1]:0;
 
    reg                            pinw_swclk;
    reg                            root_tgtclk;
@@ -249,14 +266,14 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
    assign tdi           = ((dbg_state==ST_DBG_IDLE) || (active_mode==MODE_SWJ))?pinw_tdi:(active_mode==MODE_JTAG)?jtag_tdi:1'b1;
    assign swwr          = ((dbg_state==ST_DBG_IDLE) || (active_mode==MODE_SWJ))?pinw_swwr:(active_mode==MODE_SWD)?swd_swwr:(active_mode==MODE_JTAG)?jtag_wr:1'b0;
    assign ack           = (active_mode==MODE_SWD)?swd_ack:jtag_ack;
-   assign dread         = (active_mode==MODE_SWD)?swd_dread:jtag_dread;
+   assign dread         = (active_mode==MODE_SWJ)?{24'b0,tdoshift}:(active_mode==MODE_SWD)?swd_dread:jtag_dread;
    assign tck_swclk     = ((dbg_state==ST_DBG_IDLE) || (active_mode==MODE_SWJ))?pinw_swclk:(active_mode==MODE_SWD)?swd_swclk:(active_mode==MODE_JTAG)?jtag_tck:1'b1;
 
    assign tgt_reset_pin = ~((active_mode==MODE_SWJ)?pinw_nreset:(dbg_state!=ST_DBG_RESETTING));
    assign pinsout       = { tgt_reset_pin, tgt_reset_state, 1'b1, swwr, tdo_swo, tdi, swdi, tck_swclk };
 
    // Edge calculations
-   wire        done        = (dbg_state==ST_DBG_IDLE);
+   assign      done        = (dbg_state==ST_DBG_IDLE);
    wire        anedge      = (old_tgtclk^root_tgtclk);
    wire        fallingedge = (anedge && ((~root_tgtclk) || (dbg_state==ST_DBG_IDLE)));
    wire        risingedge  = (anedge && root_tgtclk);
@@ -340,6 +357,7 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
              clkDiv      <= DEFAULT_IF_TICKS_PER_CLK;
              rst_timeout <= DEFAULT_RST_TIMEOUT_USEC;
              dbg_state   <= ST_DBG_IDLE;
+             pinw_shifted <= 0;
 	  end
 	else
           begin
@@ -354,6 +372,8 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
 
              // The usecs counter can run all of the time, it's independent
              usecsdiv<=usecsdiv?usecsdiv-1:TICKS_PER_USEC-1;
+             if ((!usecsdiv) && (usecsdown))
+               usecsdown<=usecsdown-1;
 
 
              case(dbg_state)
@@ -362,8 +382,9 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
                    begin
                       // Reset any outstanding error indication
                       perr       <= 0;
-                      case(command)
-                        CMD_PINS_WRITE: // Write pins specified in call -------------------------------
+                      (* parallel_case *)
+                      case(1'b1)
+                        |(command&CMD_PINS_WRITE): // Write pins specified in call --------------------
                           if (fallingedge)
                           begin
                              active_mode <= MODE_SWJ;
@@ -371,6 +392,7 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
                              // All bets are off on posting, don't even try
                              postedMode  <= 0;
                              pinw_swclk <= pinsin[8+0] ?pinsin[0]:0;
+                             pinw_shifted <= 0;
 
                              if (dwrite)
                                begin
@@ -385,7 +407,22 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
                                end
                           end // case: CMD_PINS_WRITE
 
-                        CMD_RESET: // Reset target ----------------------------------------------------
+                        |(command&CMD_PINS_SHIFT): // Shift bits out on SWDIO or TDI ------------------
+                          if (fallingedge)
+                          begin
+                             active_mode  <= MODE_SWJ;
+                             postedMode   <= 0;
+                             shiftreg     <= dwrite[7:0];
+                             shiftcount   <= bitcount;
+                             shiftpad     <= 4'd8-bitcount;
+                             tdoshift     <= 0;
+                             pinw_shifted <= 1;
+                             pinw_shiftdi <= dwrite[8];
+                             pinw_swclk   <= 0;
+                             dbg_state    <= ST_DBG_PINSHIFT;
+                          end
+
+                        |(command&CMD_RESET): // Reset target -----------------------------------------
                           if (fallingedge)
                             begin
                                postedMode <= 0;
@@ -394,7 +431,7 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
                                dbg_state <= ST_DBG_RESETTING;
                             end
 
-                        CMD_TRANSACT: // Execute transaction on target interface ----------------------
+                        |(command&CMD_TRANSACT): // Execute transaction on target interface -----------
                           if (fallingedge)
                             begin
                                active_mode <= commanded_mode;
@@ -427,7 +464,7 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
                                dbg_state   <= ST_DBG_WAIT_INFERIOR_START;
                             end
 
-                        CMD_SET_SWD: // Set SWD mode --------------------------------------------------
+                        |(command&CMD_SET_SWD): // Set SWD mode ---------------------------------------
                           if (fallingedge)
                           begin
                              commanded_mode <= MODE_SWD;
@@ -437,7 +474,7 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
                              dbg_state      <= ST_DBG_ESTABLISH_MODE;
                           end
 
-                        CMD_SET_JTAG: // Set JTAG mode ------------------------------------------------
+                        |(command&CMD_SET_JTAG): // Set JTAG mode -------------------------------------
                           if (fallingedge)
                           begin
                              commanded_mode <= MODE_LOCAL;
@@ -447,7 +484,7 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
                              dbg_state      <= ST_DBG_ESTABLISH_MODE;
                           end
 
-                        CMD_JTAG_GET_ID: // Get ID of specified JTAG device ---------------------------
+                        |(command&CMD_JTAG_GET_ID): // Get ID of specified JTAG device ----------------
                           begin
                              commanded_mode <= MODE_JTAG;
                              jtag_cmd       <= JTAG_CMD_READID;
@@ -455,21 +492,21 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
                              dbg_state      <= ST_DBG_WAIT_INFERIOR_START;
                           end
 
-                        CMD_JTAG_RESET: // Reset all JTAG TAPs ----------------------------------------
+                        |(command&CMD_JTAG_RESET): // Reset all JTAG TAPs -----------------------------
                           begin
                              commanded_mode <= MODE_JTAG;
                              jtag_cmd       <= JTAG_CMD_ABORT;
                              dbg_state      <= ST_DBG_WAIT_INFERIOR_START;
                           end
 
-                        CMD_SET_SWJ: // Set SWJ mode --------------------------------------------------
+                        |(command&CMD_SET_SWJ): // Set SWJ mode ---------------------------------------
                           begin
                              commanded_mode <= MODE_LOCAL;
                              pinw_swclk     <= 1;
                              dbg_state      <= ST_DBG_WAIT_GOCLEAR;
                           end
 
-                        CMD_SET_CLK: // Set clock -----------------------------------------------------
+                        |(command&CMD_SET_CLK): // Set clock ------------------------------------------
                           begin
                              if ((dwrite<MIN_CLOCK) || (dwrite>MAX_CLOCK))
                                begin
@@ -484,37 +521,37 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
                                end
                           end
 
-                        CMD_SET_SWD_CFG: // Set SWD Config ---------------------------------------------
+                        |(command&CMD_SET_SWD_CFG): // Set SWD Config ----------------------------------
                           begin
                              turnaround   <= dwrite[1:0];
                              dataphase    <= dwrite[2];
                              dbg_state    <= ST_DBG_WAIT_GOCLEAR;
                           end
 
-                        CMD_SET_JTAG_CFG: // Set JTAG Config ------------------------------------------
+                        |(command&CMD_SET_JTAG_CFG): // Set JTAG Config -------------------------------
                           begin
                              ndev         <= dwrite[3:0];
                              irlenx       <= dwrite[29:5];
                              dbg_state    <= ST_DBG_WAIT_GOCLEAR;
                           end
 
-                        CMD_SET_TFR_CFG: // Set idle cycles -------------------------------------------
+                        |(command&CMD_SET_TFR_CFG): // Set idle cycles --------------------------------
                           begin
                              idleCycles   <= dwrite[7:0];
                              dbg_state    <= ST_DBG_WAIT_GOCLEAR;
                           end
 
-                        CMD_WAIT: // Wait for specified number of uS ----------------------------------
+                        |(command&CMD_WAIT): // Wait for specified number of uS -----------------------
                           begin
                              usecsdown    <= dwrite;
                              usecsdiv     <= TICKS_PER_USEC-1;
                              dbg_state <= ST_DBG_WAIT_TIMEOUT;
                           end
 
-                        CMD_CLR_ERR: // Clear error status --------------------------------------------
+                        |(command&CMD_CLR_ERR): // Clear error status ---------------------------------
                           dbg_state <= ST_DBG_WAIT_GOCLEAR;
 
-                        CMD_SET_RST_TMR: // Set reset timer -------------------------------------------
+                        |(command&CMD_SET_RST_TMR): // Set reset timer --------------------------------
                           begin
                              rst_timeout <= dwrite;
                              dbg_state   <= ST_DBG_WAIT_GOCLEAR;
@@ -525,7 +562,7 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
                              perr         <= 1;
                              dbg_state    <= ST_DBG_WAIT_GOCLEAR;
                           end
-                      endcase // case (command)
+                      endcase // case (1'b1)
                       end // if (go)
 
                ST_DBG_WAIT_GOCLEAR: // Waiting for go indication to clear =================================
@@ -598,6 +635,37 @@ module dbgIF #(parameter CLK_FREQ=100000000, parameter DEFAULT_SWCLK=1000000, pa
                  if (!usecsdown)
                    dbg_state <= ST_DBG_WAIT_GOCLEAR;
 
+               ST_DBG_PINSHIFT: // Shifting bits out, data change with SWCLK low ==========================
+                 if (shiftcount)
+                   begin
+                      // TDO is captured in from the top, so it's in order once all 8 bits are in
+                      if (risingedge && !pinw_swclk)
+                        begin
+                           pinw_swclk <= 1;
+                           tdoshift   <= {tdo_swo,tdoshift[7:1]};
+                        end
+
+                      // Only move on once the bit has been clocked out with a rising edge
+                      if (fallingedge && pinw_swclk)
+                        begin
+                           shiftcount <= shiftcount-1;
+                           if (shiftcount!=1)
+                             begin
+                                shiftreg   <= {1'b0,shiftreg[7:1]};
+                                pinw_swclk <= 0;
+                             end
+                        end
+                   end
+                 else
+                   // All bits clocked, move short captures down to the bottom of tdoshift
+                   if (shiftpad)
+                     begin
+                        tdoshift <= {1'b0,tdoshift[7:1]};
+                        shiftpad <= shiftpad-1;
+                     end
+                   else
+                     dbg_state <= ST_DBG_WAIT_GOCLEAR;
+
                ST_DBG_WAIT_CLKCHANGE: // Waiting for clock state to change ================================
                  if (fallingedge)
                    dbg_state <= ST_DBG_WAIT_GOCLEAR;
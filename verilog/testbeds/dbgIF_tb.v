@@ -49,7 +49,8 @@ module dbgIF_tb;
    wire [31:0] dread_tb;
 
    // Actuation & Responses
-   reg [3:0]   command_tb;
+   reg [15:0]  command_tb;
+   reg [3:0]   bitcount_tb;
 
    reg         go_tb;
    wire        done_tb;
@@ -90,6 +91,7 @@ module dbgIF_tb;
               .dwrite(dwrite_tb),  // Data/Parameter out to be written
               .dread(dread_tb),    // Data/Result in
               .pinsin(pinsin_tb),  // Pin setting information
+              .bitcount(bitcount_tb), // Bits to shift
               .pinsout(pinsout_tb),// Current state of pins
 
               .command(command_tb),// Command out
@@ -126,6 +128,22 @@ module dbgIF_tb;
      end
    always @(posedge tck_swclk_tb)
         $write("%d",tms_swdio_tb);
+
+   // Bits shifted out by CMD_PINS_SHIFT, as the target sees them at each rising edge of the
+   // clock, shifted in from the top. shtdi selects TDI rather than SWDIO.
+   reg         shtdi;
+   reg [7:0]   shcap;
+   integer     shclks;
+
+   always @(posedge tck_swclk_tb)
+     begin
+        shcap  <= {shtdi?tdi_tb:tms_swdio_tb,shcap[7:1]};
+        shclks <= shclks+1;
+     end
+
+   // TDO is looped back from TDI, so a shift on TDI comes straight back in dread
+   always @(*)
+     tdo_swo_tb = tdi_tb;
    realtime t;
 
    initial begin
@@ -133,6 +151,7 @@ module dbgIF_tb;
 
 
       go_tb=0;
+      bitcount_tb=0;
 
       rst_tb=0;
       clk_tb=0;
@@ -153,7 +172,6 @@ module dbgIF_tb;
 
       `go;
       `report;
-      $finish;
 
       // =========================================== Perform a reset
       $display("\nPerforming Reset;");
@@ -188,7 +206,9 @@ module dbgIF_tb;
 
       // =========================================== Check error
       $display("\nCheck error;");
-      command_tb=15;
+      // Commands are one-hot, so the only id that matches none of them is zero. 15 used to
+      // be unused, but is now RESET, PINS_WRITE, TRANSACT and SET_SWD at once.
+      command_tb=0;
       `go;
       if (perr_tb!=1)
         begin
@@ -251,18 +271,18 @@ module dbgIF_tb;
       if (tdi_tb!=0)
         $display("ERROR, TDI not at 0");
 
-      // RESET
+      // RESET. The pin drives the pull down on nRESET, so it is the inverse of the nRESET bit.
       pinsin_tb={1'b1, 7'b0,  1'b1,7'b0};
       `go;
-      pc|=(tgt_reset_tb!=1);
-
-      if (tgt_reset_tb!=1)
-        $display("ERROR, TGT_RESET not at 1");
-      pinsin_tb={1'b1, 7'b0,  1'b0,7'b0};
-      `go;
       pc|=(tgt_reset_tb!=0);
+
       if (tgt_reset_tb!=0)
         $display("ERROR, TGT_RESET not at 0");
+      pinsin_tb={1'b1, 7'b0,  1'b0,7'b0};
+      `go;
+      pc|=(tgt_reset_tb!=1);
+      if (tgt_reset_tb!=1)
+        $display("ERROR, TGT_RESET not at 1");
 
       if (!pc)
         $display("CORRECT, pinsetting passed");
@@ -350,6 +370,58 @@ module dbgIF_tb;
            $display("Returned [ACK %3b]",ack_tb);
         end
 
+      // =========================================== Shift bits out
+      $display("\nPins shift checks;");
+      pc=0;
+      command_tb=DUT.CMD_PINS_SHIFT;
+
+      // Eight bits on SWDIO, which must go out lsb first
+      pinsin_tb={3'b0,1'b1,4'b0,  3'b0,1'b1,4'b0};
+      shtdi=0; shcap=0; shclks=0;
+      bitcount_tb=4'd8;
+      dwrite_tb<=32'h0b5;
+      `go;
+      `report;
+      if ((shclks!=8) || (shcap!=8'hb5))
+        begin
+           pc=1;
+           $display("ERROR, SWDIO shift sent %02x in %d clocks",shcap,shclks);
+        end
+
+      // Five bits on TDI. The bits above bitcount must not go out, and the TDO captured
+      // for a short shift comes back right justified in dread.
+      pinsin_tb=0;
+      shtdi=1; shcap=0; shclks=0;
+      bitcount_tb=4'd5;
+      dwrite_tb<={23'b0,1'b1,8'hf6};
+      `go;
+      `report;
+      if ((shclks!=5) || ((shcap>>3)!=8'h16) || (dread_tb!=32'h16))
+        begin
+           pc=1;
+           $display("ERROR, TDI shift sent %02x in %d clocks, TDO %08x",shcap>>3,shclks,dread_tb);
+        end
+
+      // A single bit on TDI
+      shcap=0; shclks=0;
+      bitcount_tb=4'd1;
+      dwrite_tb<={23'b0,1'b1,8'hff};
+      `go;
+      `report;
+      if ((shclks!=1) || ((shcap>>7)!=8'h01) || (dread_tb!=32'h01))
+        begin
+           pc=1;
+           $display("ERROR, TDI single bit sent %02x in %d clocks, TDO %08x",shcap>>7,shclks,dread_tb);
+        end
+
+      if (!pc)
+        $display("CORRECT, pins shift passed");
+      else
+        begin
+           $display("ERROR, pins shift failed");
+           $finish();
+        end
+
       #50;
 
       $finish;